@@ -13,6 +13,7 @@ setup(
         "usertools",
         "usertools.management",
         "usertools.management.commands",
+        "usertools.migrations",
         "usertools.templatetags",
     ],
     install_requires=[
@@ -26,6 +27,8 @@ setup(
             "locale/*/LC_MESSAGES/django.*",
             "templates/admin/auth/user/*.html",
             "templates/admin/auth/user/*.txt",
+            "templates/admin/auth/group/*.html",
+            "templates/admin/usertools/*.html",
         ],
     },
     classifiers=[
@@ -11,7 +11,11 @@ DATABASES = {
         'PASSWORD': '',
         'HOST': '',
         'PORT': '',
-    }
+    },
+    'other': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': 'test_project_other.db',
+    },
 }
 
 # Hosts/domain names that are valid for this site; required if DEBUG is False
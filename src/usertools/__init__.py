@@ -5,3 +5,5 @@ Developed by Dave Hall.
 
 <http://www.etianen.com/>
 """
+
+default_app_config = "usertools.apps.UsertoolsConfig"
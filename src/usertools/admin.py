@@ -2,7 +2,9 @@
 
 from __future__ import unicode_literals
 
+import socket
 from functools import partial
+from smtplib import SMTPException
 
 from django import template
 from django.conf import settings
@@ -10,22 +12,43 @@ from django.conf.urls import url
 from django.contrib.auth.models import User, Group
 from django.contrib.auth.forms import AdminPasswordChangeForm
 from django.contrib.auth.admin import UserAdmin as UserAdminBase, GroupAdmin as GroupAdminBase
-from django.contrib import admin, auth
+from django.contrib.auth.backends import ModelBackend
+from django.contrib import admin, auth, messages
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ERROR_FLAG, PAGE_VAR
 from django.contrib.admin.utils import flatten_fieldsets
 from django.core.exceptions import PermissionDenied
 try:
     from django.urls import reverse
 except ImportError:  # Django < 1.10 pragma: no cover
     from django.core.urlresolvers import reverse
-from django.core.mail import send_mail
-from django.db import transaction
-from django.db.models import Count
+from django.core.mail import EmailMessage, get_connection
+from django.db import IntegrityError, router, transaction
+from django.db.models import Count, F
+from django.http import StreamingHttpResponse
 from django.shortcuts import render, redirect
 from django.contrib.auth.tokens import default_token_generator
 from django.utils.http import int_to_base36, base36_to_int
 from django.utils.encoding import force_text
-
-from usertools.forms import UserCreationForm, UserChangeForm, UserInviteForm
+from django.utils.module_loading import import_string
+
+from usertools import membercounts, outbox
+from usertools.autocomplete import AutocompleteAdminMixin, AutocompleteSelectMultiple, autocomplete_response
+from usertools.bulk import update_users, add_users_to_group, remove_users_from_group, create_users
+from usertools.cache import get_groups
+from usertools.exporting import EXPORT_FORMATS, iter_user_rows
+from usertools.filters import GroupAutocompleteFilter
+from usertools.forms import (
+    UserCreationForm, UserChangeForm, UserInviteForm, UserImportForm, UserImportRowForm, GroupActionForm,
+    GroupMultipleChoiceField,
+)
+from usertools.importing import ImportReport, iter_csv_rows, iter_batches, get_group_names
+from usertools.instrumentation import instrument, instrumented, record, record_smtp
+from usertools.pagination import CURSOR_VAR, ScalablePaginationMixin
+from usertools.ratelimit import rate_limit
+from usertools.search import get_search_backend
+from usertools.transport import get_transport
 
 
 # Mix in watson search, if available.
@@ -36,7 +59,7 @@ else:
     AdminBase = admin.ModelAdmin
 
 
-class UserAdmin(UserAdminBase, AdminBase):
+class UserAdmin(ScalablePaginationMixin, AutocompleteAdminMixin, UserAdminBase, AdminBase):
 
     """Enhanced user admin class."""
 
@@ -54,9 +77,36 @@ class UserAdmin(UserAdminBase, AdminBase):
 
     invite_confirm_form_template = "admin/auth/user/invite_confirm_form.html"
 
+    group_action_form_template = "admin/auth/user/group_action_form.html"
+
+    import_form = UserImportForm
+
+    import_row_form = UserImportRowForm
+
+    import_form_template = "admin/auth/user/import_form.html"
+
+    # The number of CSV rows validated and created in each transaction of a user import.
+    import_batch_size = 500
+
+    # The number of users read from the database in each query of an export.
+    export_chunk_size = 2000
+
+    # If True, a single pair of group actions is shown, and the group is chosen on an
+    # intermediate page. Otherwise, a pair of actions is shown for every group.
+    group_action_picker = False
+
+    # The number of users to change in each query of a bulk action.
+    bulk_batch_size = 1000
+
+    # If True, bulk actions skip users that are already in the target state.
+    bulk_skip_unchanged = False
+
+    # If True, the groups filter is a search box that loads matching groups on demand. Requires Django 2.0+.
+    lazy_group_filter = False
+
     search_fields = ("username", "first_name", "last_name", "email",)
 
-    actions = ("invite_selected", "activate_selected", "deactivate_selected",)
+    actions = ("invite_selected", "activate_selected", "deactivate_selected", "export_selected",)
 
     list_display = ("username", "first_name", "last_name", "email", "is_staff", "is_active",)
 
@@ -121,10 +171,15 @@ class UserAdmin(UserAdminBase, AdminBase):
 
     filter_horizontal = ("groups", "user_permissions",)
 
+    autocomplete_url_names = {
+        "groups": "auth_user_group_autocomplete",
+        "user_permissions": "auth_user_permission_autocomplete",
+    }
+
     # Custom actions.
 
-    def do_send_invitation_email(self, request, user):
-        """Sends an invitation email to the given user."""
+    def get_invitation_email(self, request, user, connection=None):
+        """Returns an unsent invitation email for the given user."""
         confirmation_url = request.build_absolute_uri(
             reverse("{admin_site}:auth_user_invite_confirm".format(
                 admin_site=self.admin_site.name,
@@ -133,7 +188,7 @@ class UserAdmin(UserAdminBase, AdminBase):
                 "token": default_token_generator.make_token(user),
             })
         )
-        send_mail(
+        return EmailMessage(
             "{prefix}You have been invited to create an account".format(
                 prefix=settings.EMAIL_SUBJECT_PREFIX,
             ),
@@ -148,24 +203,106 @@ class UserAdmin(UserAdminBase, AdminBase):
                 last_name=user.last_name,
                 email=user.email,
             ),),
+            connection=connection,
         )
 
+    def do_send_invitation_email(self, request, user, connection=None):
+        """
+        Sends an invitation email to the given user.
+
+        If a connection is given, it is reused rather than opening a new one.
+        Otherwise, the email is handed to the invitation transport, which may
+        send it in the background. If the invitation outbox is enabled, the
+        email is queued for the sendinvitations command instead.
+        """
+        message = self.get_invitation_email(request, user, connection=connection)
+        if outbox.is_enabled():
+            outbox.enqueue(message, user)
+            return
+        transport = get_transport()
+        if connection is None and transport.background:
+            transport.send(message)
+        else:
+            with record_smtp():
+                message.send()
+            record(emails_sent=1)
+
+    def do_send_invitation_emails(self, request, users):
+        """
+        Sends an invitation email to each of the given users over a single connection.
+
+        Returns a tuple of (sent users, failed users). A failure to deliver to one
+        user does not prevent delivery to the rest.
+        """
+        sent = []
+        failed = []
+        if outbox.is_enabled():
+            for user in users:
+                self.do_send_invitation_email(request, user)
+                sent.append(user)
+            return sent, failed
+        connection = get_connection()
+        try:
+            with record_smtp():
+                connection.open()
+        except (SMTPException, socket.error):
+            # The mail server couldn't be reached, so none of the users can be sent an invitation.
+            failed.extend(users)
+            return sent, failed
+        try:
+            for user in users:
+                try:
+                    self.do_send_invitation_email(request, user, connection=connection)
+                except (SMTPException, socket.error):
+                    failed.append(user)
+                else:
+                    sent.append(user)
+        finally:
+            with record_smtp():
+                connection.close()
+        return sent, failed
+
     def invite_selected(self, request, qs):
         """Sends an invitation email to the selected users."""
-        count = 0
-        for user in qs.iterator():
-            self.do_send_invitation_email(request, user)
-            count += 1
+        sent, failed = self.do_send_invitation_emails(request, qs.iterator())
+        record(users=len(sent) + len(failed))
+        count = len(sent)
         self.message_user(request, "{count} {item} sent an invitation email.".format(
             count=count,
             item=count != 1 and "users were" or "user was",
         ))
+        if failed:
+            self.message_user(request, "Could not send an invitation email to {emails}.".format(
+                emails=", ".join(user.email for user in failed),
+            ), level=messages.WARNING)
     invite_selected.short_description = "Invite selected users to the admin system"
 
+    def get_export_response(self, request, qs, export_format):
+        """Returns a streaming response exporting the users in the queryset, with their groups."""
+        iter_lines, content_type = EXPORT_FORMATS[export_format]
+        response = StreamingHttpResponse(
+            iter_lines(iter_user_rows(qs, chunk_size=self.export_chunk_size)),
+            content_type=content_type,
+        )
+        response["Content-Disposition"] = "attachment; filename=users.{export_format}".format(
+            export_format=export_format,
+        )
+        return response
+
+    def export_selected(self, request, qs):
+        """Exports the selected users as CSV."""
+        return self.get_export_response(request, qs, "csv")
+    export_selected.short_description = "Export selected users as CSV"
+
     def activate_selected(self, request, qs):
         """Activates the selected users."""
-        qs.update(is_active=True)
-        count = qs.count()
+        count = update_users(
+            qs,
+            batch_size=self.bulk_batch_size,
+            skip_unchanged=self.bulk_skip_unchanged,
+            is_active=True,
+        )
+        record(users=count)
         self.message_user(request, "{count} {item} marked as active.".format(
             count=count,
             item=count != 1 and "users were" or "user was",
@@ -174,8 +311,13 @@ class UserAdmin(UserAdminBase, AdminBase):
 
     def deactivate_selected(self, request, qs):
         """Deactivates the selected users."""
-        qs.update(is_active=False)
-        count = qs.count()
+        count = update_users(
+            qs,
+            batch_size=self.bulk_batch_size,
+            skip_unchanged=self.bulk_skip_unchanged,
+            is_active=False,
+        )
+        record(users=count)
         self.message_user(request, "{count} {item} marked as inactive.".format(
             count=count,
             item=count != 1 and "users were" or "user was",
@@ -184,9 +326,8 @@ class UserAdmin(UserAdminBase, AdminBase):
 
     def add_selected_to_group(self, request, qs, group):
         """Adds the selected users to a group."""
-        for user in qs:
-            user.groups.add(group)
-        count = len(qs)
+        count = add_users_to_group(qs, group, batch_size=self.bulk_batch_size)
+        record(users=count)
         self.message_user(request, "{count} {item} added to {group}.".format(
             count=count,
             item=count != 1 and "users were" or "user was",
@@ -195,26 +336,73 @@ class UserAdmin(UserAdminBase, AdminBase):
 
     def remove_selected_from_group(self, request, qs, group):
         """Removes the selected users from a group."""
-        for user in qs:
-            user.groups.remove(group)
-        count = len(qs)
+        count = remove_users_from_group(qs, group)
+        record(users=count)
         self.message_user(request, "{count} {item} removed from {group}.".format(
             count=count,
             item=count != 1 and "users were" or "user was",
             group=group,
         ))
 
+    def do_group_action(self, request, qs, group_action, title):
+        """Chooses a group on an intermediate page, then runs the given group action."""
+        form = GroupActionForm(
+            request.POST if "_apply" in request.POST else None,
+            admin_site=self.admin_site,
+        )
+        if form.is_valid():
+            group_action(request, qs, form.cleaned_data["group"])
+            return None
+        return render(request, self.group_action_form_template, dict(
+            self.admin_site.each_context(request),
+            title=title,
+            opts=self.model._meta,
+            form=form,
+            media=self.media + form.media,
+            action=request.POST["action"],
+            action_checkbox_name=ACTION_CHECKBOX_NAME,
+            selected=request.POST.getlist(ACTION_CHECKBOX_NAME),
+            select_across=request.POST.get("select_across", "0"),
+            count=qs.count(),
+        ))
+
+    def add_selected_to_chosen_group(self, request, qs):
+        """Adds the selected users to a group chosen on an intermediate page."""
+        return self.do_group_action(request, qs, self.add_selected_to_group, "Add selected users to group")
+    add_selected_to_chosen_group.short_description = "Add selected users to group..."
+
+    def remove_selected_from_chosen_group(self, request, qs):
+        """Removes the selected users from a group chosen on an intermediate page."""
+        return self.do_group_action(request, qs, self.remove_selected_from_group, "Remove selected users from group")
+    remove_selected_from_chosen_group.short_description = "Remove selected users from group..."
+
+    def response_action(self, request, queryset):
+        """Runs the chosen action, instrumented as a usertools.action operation."""
+        action_names = request.POST.getlist("action")
+        try:
+            action_name = action_names[int(request.POST.get("index", 0))]
+        except (IndexError, ValueError):
+            action_name = ""
+        with instrument("usertools.action.{action_name}".format(action_name=action_name)):
+            return super(UserAdmin, self).response_action(request, queryset)
+
     def get_actions(self, request):
         """Returns the actions this admin class supports."""
         actions = super(UserAdmin, self).get_actions(request)
-        # Add in the group actions.
+        # Add in the chosen group actions.
+        if self.group_action_picker:
+            for action_name in ("add_selected_to_chosen_group", "remove_selected_from_chosen_group",):
+                actions[action_name] = self.get_action(action_name)
+            return actions
+        # Add in the group actions. The group list is cached until a group changes, or the cache timeout expires.
+        db = router.db_for_read(Group)
         groups = [
             ("{slug}_{pk}".format(
-                slug=force_text(group).replace(" ", "_").lower(),
-                pk=group.pk,
-            ), group)
-            for group
-            in Group.objects.all()
+                slug=force_text(name).replace(" ", "_").lower(),
+                pk=pk,
+            ), Group.from_db(db, ("id", "name",), (pk, name,)))
+            for pk, name
+            in get_groups()
         ]
         # Create the add actions.
         for group_slug, group in groups:
@@ -243,6 +431,53 @@ class UserAdmin(UserAdminBase, AdminBase):
         # All done!
         return actions
 
+    # Search.
+
+    def get_search_results(self, request, queryset, search_term):
+        """Searches using the configured usertools search backend, if any, once its index has been built."""
+        search_backend = get_search_backend()
+        if search_backend is None or not search_term.strip() or not search_backend.is_installed(queryset.db):
+            return super(UserAdmin, self).get_search_results(request, queryset, search_term)
+        return search_backend.search(queryset, search_term), False
+
+    def has_lazy_group_filter(self):
+        """Returns True if the groups filter should be a search box, which needs the Django 2.0+ select2 assets."""
+        return self.lazy_group_filter and AutocompleteSelectMultiple is not None
+
+    @property
+    def media(self):
+        media = super(UserAdmin, self).media
+        if self.has_lazy_group_filter():
+            # The group filter is rendered outside of any form, so its select2 assets are added to the admin media,
+            # where they are deduplicated with the rest of the page.
+            media += AutocompleteSelectMultiple(
+                self.autocomplete_url_names["groups"],
+                self.model._meta.get_field("groups").remote_field,
+                self.admin_site,
+            ).media
+        return media
+
+    def get_list_filter(self, request):
+        """Returns the list filters, replacing the groups filter if lazy_group_filter is set."""
+        list_filter = super(UserAdmin, self).get_list_filter(request)
+        if self.has_lazy_group_filter():
+            list_filter = [
+                ("groups", GroupAutocompleteFilter) if list_filter_item == "groups" else list_filter_item
+                for list_filter_item
+                in list_filter
+            ]
+        return list_filter
+
+    def formfield_for_manytomany(self, db_field, request=None, **kwargs):
+        if db_field.name == "user_permissions":
+            # Avoid a content type query for every selected permission.
+            qs = kwargs.get("queryset", db_field.remote_field.model.objects)
+            kwargs["queryset"] = qs.select_related("content_type")
+        if db_field.name == "groups":
+            # Render the group choices from the cached list of groups.
+            kwargs.setdefault("form_class", GroupMultipleChoiceField)
+        return super(UserAdmin, self).formfield_for_manytomany(db_field, request, **kwargs)
+
     # Custom views.
 
     def get_urls(self):
@@ -253,14 +488,61 @@ class UserAdmin(UserAdminBase, AdminBase):
         urlpatterns = [
             # User invite.
             url("^invite/$", admin_view(self.invite_user), name="auth_user_invite"),
+            url("^import/$", admin_view(self.import_users), name="auth_user_import"),
+            url("^export/(?P<export_format>csv|jsonl)/$", admin_view(self.export_users), name="auth_user_export"),
             url(
                 "^invite/(?P<uidb36>[^-]+)-(?P<token>[^/]+)/$",
-                self.invite_user_confirm, name="auth_user_invite_confirm",
+                rate_limit("invite_confirm", get_target=lambda request, uidb36, token: uidb36)(
+                    self.invite_user_confirm,
+                ),
+                name="auth_user_invite_confirm",
+            ),
+            # Autocomplete.
+            url("^groups/autocomplete/$", admin_view(self.group_autocomplete), name="auth_user_group_autocomplete"),
+            url(
+                "^permissions/autocomplete/$",
+                admin_view(self.permission_autocomplete),
+                name="auth_user_permission_autocomplete",
             ),
         ] + urlpatterns
         return urlpatterns
 
-    @transaction.atomic()
+    def group_autocomplete(self, request):
+        """Returns a page of the groups matching a search term, as JSON."""
+        self.check_autocomplete_permission(request)
+        return autocomplete_response(request, Group.objects.order_by("name", "pk"), ("name",))
+
+    def invitation_email_failed(self, request, user, exception):
+        """
+        Called when the invitation email for a newly invited user could not be sent.
+
+        The user has already been saved, so the email can be sent again using the
+        invite selected users action.
+        """
+        self.message_user(
+            request,
+            "The user {username} was created, but an invitation email could not be sent to {email}.".format(
+                username=user.get_username(),
+                email=user.email,
+            ),
+            level=messages.ERROR,
+        )
+
+    def send_invitation_email_on_commit(self, request, user):
+        """Sends the invitation email for a newly invited user, once the user has been committed."""
+        try:
+            self.do_send_invitation_email(request, user)
+        except Exception as ex:
+            # The user has already been committed, so any error, such as a bad header or a broken template, is
+            # reported rather than failing the request.
+            self.invitation_email_failed(request, user, ex)
+        else:
+            self.message_user(request, "An invitation email {verb} to {email}.".format(
+                verb="is being sent" if get_transport().background else "has been sent",
+                email=user.email,
+            ))
+
+    @instrumented("usertools.invite_user")
     def invite_user(self, request):
         """Sends an invitation email with a login token."""
         # Check for add and change permission.
@@ -281,18 +563,25 @@ class UserAdmin(UserAdminBase, AdminBase):
         if request.method == "POST":
             form = InviteForm(request.POST)
             if form.is_valid():
-                # Save the user, marked as inactive.
-                user = form.save(commit=False)
-                user.is_active = False
-                user.is_staff = True
-                user.save()
-                form.save_m2m()
-                # Send an invitation email.
-                self.do_send_invitation_email(request, user)
-                # Message the user.
-                self.message_user(request, "An invitation email has been sent to {email}.".format(
-                    email=user.email,
-                ))
+                using = router.db_for_write(User)
+                with transaction.atomic(using=using):
+                    # Save the user, marked as inactive.
+                    user = form.save(commit=False)
+                    user.is_active = False
+                    user.is_staff = True
+                    user.save()
+                    form.save_m2m()
+                    record(users=1)
+                    if outbox.is_enabled():
+                        # Queue the invitation in the same transaction as the user.
+                        self.do_send_invitation_email(request, user)
+                        self.message_user(request, "An invitation email has been queued for {email}.".format(
+                            email=user.email,
+                        ))
+                    else:
+                        # Render and send the invitation email once the user has been committed,
+                        # so a slow mail server doesn't hold the transaction open.
+                        transaction.on_commit(partial(self.send_invitation_email_on_commit, request, user), using=using)
                 # Redirect as appropriate.
                 # Using the superclass to avoid the built in munging of the add response.
                 return super(UserAdminBase, self).response_add(request, user)
@@ -321,6 +610,209 @@ class UserAdmin(UserAdminBase, AdminBase):
             has_editable_inline_admin_formsets=True,
         ))
 
+    def do_import_users(self, request, csv_file):
+        """
+        Creates and invites the users in a CSV file, returning an ImportReport.
+
+        Rows are validated, created and invited a batch at a time, so memory use
+        and the number of queries per batch don't grow with the size of the file.
+        """
+        report = ImportReport()
+        group_pks_by_name = dict((name, pk) for pk, name in get_groups())
+        seen_usernames = set()
+        rows = iter_csv_rows(csv_file)
+        try:
+            for batch in iter_batches(rows, self.import_batch_size):
+                self.do_import_users_batch(request, batch, report, group_pks_by_name, seen_usernames)
+        except ValueError as ex:
+            # If nothing has been imported yet, report the unreadable file as a form error.
+            if not report.created and not report.errors:
+                raise
+            report.add_error(None, "", force_text(ex))
+        return report
+
+    def do_import_users_batch(self, request, rows, report, group_pks_by_name, seen_usernames):
+        """Validates, creates and invites the users in a batch of CSV rows."""
+        candidates = []
+        # Validate the rows.
+        for line_number, row in rows:
+            username = (row.get("username") or "").strip()
+            form = self.import_row_form(dict(
+                (field_name, row.get(field_name) or "")
+                for field_name
+                in self.import_row_form._meta.fields
+            ))
+            group_names = get_group_names(row)
+            unknown_group_names = [name for name in group_names if name not in group_pks_by_name]
+            if not form.is_valid():
+                report.add_error(line_number, username, " ".join(
+                    "{field}: {message}".format(field=field_name, message=message)
+                    for field_name, field_messages
+                    in form.errors.items()
+                    for message
+                    in field_messages
+                ))
+            elif unknown_group_names:
+                report.add_error(line_number, username, "Unknown group: {names}.".format(
+                    names=", ".join(unknown_group_names),
+                ))
+            elif form.cleaned_data["username"] in seen_usernames:
+                report.add_error(line_number, username, "The username appears more than once in the file.")
+            else:
+                user = form.save(commit=False)
+                user.is_active = False
+                user.is_staff = True
+                seen_usernames.add(user.username)
+                candidates.append((line_number, user, [group_pks_by_name[name] for name in group_names]))
+        # Skip existing users and create and invite the rest. The existing users are checked with one query in
+        # the same transaction as the insert. Queued invitations are saved in the same transaction as the users,
+        # but emails are only sent once the users have been committed.
+        using = router.db_for_write(User)
+        try:
+            with transaction.atomic(using=using):
+                existing_usernames = set(User.objects.using(using).filter(
+                    username__in=[user.username for _, user, _ in candidates],
+                ).values_list("username", flat=True))
+                new_rows = [
+                    (line_number, user, group_pks)
+                    for line_number, user, group_pks
+                    in candidates
+                    if user.username not in existing_usernames
+                ]
+                if new_rows:
+                    users = create_users(
+                        [user for _, user, _ in new_rows],
+                        [group_pks for _, _, group_pks in new_rows],
+                    )
+                    if outbox.is_enabled():
+                        sent, failed = self.do_send_invitation_emails(request, users)
+        except IntegrityError:
+            # Another request created some of the users between the check and the insert, and the whole batch
+            # was rolled back.
+            existing_usernames = set(User.objects.using(using).filter(
+                username__in=[user.username for _, user, _ in candidates],
+            ).values_list("username", flat=True))
+            for line_number, user, _ in candidates:
+                if user.username in existing_usernames:
+                    report.add_error(line_number, user.username, "A user with that username already exists.")
+                else:
+                    report.add_error(
+                        line_number,
+                        user.username,
+                        "The user was not created, because another user was created at the same time. "
+                        "Import the row again.",
+                    )
+            return
+        for line_number, user, _ in candidates:
+            if user.username in existing_usernames:
+                report.add_error(line_number, user.username, "A user with that username already exists.")
+        if not new_rows:
+            return
+        # Bulk inserts skip the post_save signal that updates the search index.
+        search_backend = get_search_backend()
+        if search_backend is not None:
+            search_backend.update(users, using=using)
+        if not outbox.is_enabled():
+            sent, failed = self.do_send_invitation_emails(request, users)
+        record(users=len(users))
+        report.created += len(users)
+        report.invited += len(sent)
+        failed_pks = set(user.pk for user in failed)
+        for (line_number, _, _), user in zip(new_rows, users):
+            if user.pk in failed_pks:
+                report.add_error(line_number, user.username, "The user was created, but could not be invited.")
+
+    @instrumented("usertools.import_users")
+    def import_users(self, request):
+        """Creates users from an uploaded CSV file, and sends each an invitation email."""
+        # Check for add and change permission.
+        has_add_permission = self.has_add_permission(request)
+        has_change_permission = self.has_change_permission(request)
+        if not has_add_permission or not has_change_permission:
+            raise PermissionDenied
+        # Process the form.
+        report = None
+        if request.method == "POST":
+            form = self.import_form(request.POST, request.FILES)
+            if form.is_valid():
+                try:
+                    report = self.do_import_users(request, form.cleaned_data["csv_file"])
+                except ValueError as ex:
+                    form.add_error("csv_file", force_text(ex))
+        else:
+            form = self.import_form()
+        # Create the admin form.
+        admin_form = admin.helpers.AdminForm(form, [(None, {"fields": list(form.fields)})], {})
+        # Render the template.
+        return render(request, self.import_form_template, dict(
+            self.admin_site.each_context(request),
+            title="Import and invite users",
+            opts=self.model._meta,
+            form=form,
+            adminform=admin_form,
+            media=self.media + admin_form.media,
+            report=report,
+            add=True,
+            change=False,
+            is_popup=False,
+            save_as=False,
+            has_add_permission=has_add_permission,
+            has_change_permission=has_change_permission,
+            has_delete_permission=False,
+            has_file_field=True,
+            show_delete=False,
+            has_view_permission=True,
+            has_editable_inline_admin_formsets=True,
+        ))
+
+    def get_export_changelist(self, request):
+        """Returns the changelist used to find the exported users, matching the changelist view."""
+        if hasattr(self, "get_changelist_instance"):
+            return self.get_changelist_instance(request)
+        # Django < 2.0 builds the changelist inside the changelist view.
+        list_display = self.get_list_display(request)
+        try:
+            list_select_related = self.get_list_select_related(request)
+        except AttributeError:  # Django < 1.9.
+            list_select_related = self.list_select_related
+        ChangeList = self.get_changelist(request)
+        return ChangeList(
+            request, self.model, list_display,
+            self.get_list_display_links(request, list_display), self.get_list_filter(request), self.date_hierarchy,
+            self.get_search_fields(request), list_select_related, self.list_per_page,
+            self.list_max_show_all, self.list_editable, self,
+        )
+
+    def export_users(self, request, export_format):
+        """Exports the users matching the changelist filters and search, with their groups."""
+        try:
+            has_view_permission = self.has_view_permission(request)
+        except AttributeError:
+            has_view_permission = self.has_change_permission(request)
+        if not has_view_permission:
+            raise PermissionDenied
+        # Export every matching user, not just the current page.
+        request.GET = request.GET.copy()
+        for name in (PAGE_VAR, CURSOR_VAR):
+            request.GET.pop(name, None)
+        try:
+            cl = self.get_export_changelist(request)
+        except IncorrectLookupParameters:
+            return redirect("{url}?{error_flag}=1".format(
+                url=reverse("{admin_site}:auth_user_changelist".format(admin_site=self.admin_site.name)),
+                error_flag=ERROR_FLAG,
+            ))
+        return self.get_export_response(request, cl.get_queryset(request), export_format)
+
+    def get_invite_confirm_backend(self, request, user):
+        """Returns the dotted path of the authentication backend used to log in a user confirming an invitation."""
+        backend_paths = settings.AUTHENTICATION_BACKENDS
+        for backend_path in backend_paths:
+            if issubclass(import_string(backend_path), ModelBackend):
+                return backend_path
+        return backend_paths[0]
+
+    @instrumented("usertools.invite_user_confirm")
     def invite_user_confirm(self, request, uidb36, token):
         """Performs confirmation of the invite user email."""
         form = None
@@ -345,8 +837,10 @@ class UserAdmin(UserAdminBase, AdminBase):
                         # Activate the user.
                         user.is_active = True
                         user.save()
-                        # Login the user.
-                        user = auth.authenticate(username=user.username, password=form.cleaned_data["password1"])
+                        record(users=1)
+                        # Login the user. The password has just been set, so there's no need to hash it again
+                        # by authenticating.
+                        user.backend = self.get_invite_confirm_backend(request, user)
                         auth.login(request, user)
                         # Message and redirect.
                         self.message_user(
@@ -380,24 +874,53 @@ admin.site.unregister(User)
 admin.site.register(User, UserAdmin)
 
 
-class GroupAdmin(GroupAdminBase, AdminBase):
+class GroupAdmin(ScalablePaginationMixin, AutocompleteAdminMixin, GroupAdminBase, AdminBase):
 
     """Enhanced group admin class."""
 
     list_display = ("name", "get_user_count",)
 
+    autocomplete_url_names = {
+        "permissions": "auth_group_permission_autocomplete",
+    }
+
+    def changelist_view(self, request, extra_context=None):
+        """Stores the member count of any group without one, so it isn't shown as zero."""
+        if membercounts.is_enabled():
+            membercounts.recount_missing(using=router.db_for_write(Group))
+        return super(GroupAdmin, self).changelist_view(request, extra_context)
+
     def get_queryset(self, request, *args, **kwargs):
         """Modifies the queryset."""
         qs = super(GroupAdmin, self).get_queryset(request, *args, **kwargs)
-        qs = qs.annotate(
-            user_count=Count("user"),
-        )
+        if membercounts.is_enabled():
+            qs = qs.annotate(
+                user_count=F("usertools_member_count__count"),
+            )
+        else:
+            qs = qs.annotate(
+                user_count=Count("user"),
+            )
         return qs
 
+    def get_urls(self):
+        """Returns the URLs used by this admin class."""
+        urlpatterns = super(GroupAdmin, self).get_urls()
+        admin_view = self.admin_site.admin_view
+        urlpatterns = [
+            url(
+                "^permissions/autocomplete/$",
+                admin_view(self.permission_autocomplete),
+                name="auth_group_permission_autocomplete",
+            ),
+        ] + urlpatterns
+        return urlpatterns
+
     def get_user_count(self, obj):
         """Returns the number of users in the given group."""
-        return obj.user_count
+        return obj.user_count or 0
     get_user_count.short_description = "members"
+    get_user_count.admin_order_field = "user_count"
 
 
 # Automatcally re-register the Group model with the enhanced admin class.
@@ -0,0 +1,14 @@
+"""App configuration for django-usertools."""
+
+from django.apps import AppConfig
+
+
+class UsertoolsConfig(AppConfig):
+
+    name = "usertools"
+
+    verbose_name = "User tools"
+
+    def ready(self):
+        # Connect the signal receivers.
+        from usertools import receivers  # noqa
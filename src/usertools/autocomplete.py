@@ -0,0 +1,164 @@
+"""
+Paginated autocomplete endpoints for the usertools admin.
+
+Responses use the select2 format understood by the Django admin's
+autocomplete.js, so any select with the admin-autocomplete class can use them.
+"""
+
+from __future__ import unicode_literals
+
+import copy
+import operator
+from functools import reduce
+
+from django.contrib.auth.models import Permission
+from django.core.exceptions import PermissionDenied
+from django.db.models import Q
+from django.http import JsonResponse
+from django.utils.encoding import force_text
+try:
+    from django.contrib.admin.widgets import AutocompleteSelectMultiple as AutocompleteSelectMultipleBase
+except ImportError:  # Django < 2.0 pragma: no cover
+    AutocompleteSelectMultipleBase = None
+try:
+    from django.urls import reverse
+except ImportError:  # Django < 1.10 pragma: no cover
+    from django.core.urlresolvers import reverse
+
+
+# The number of results returned in each page of an autocomplete response.
+PAGE_SIZE = 20
+
+
+def get_page_number(request):
+    """Returns the requested page number, starting from 1."""
+    try:
+        return max(int(request.GET.get("page", 1)), 1)
+    except ValueError:
+        return 1
+
+
+def autocomplete_response(request, queryset, search_fields, page_size=PAGE_SIZE):
+    """
+    Returns a page of the queryset filtered by the term in the request.
+
+    Each word of the term must be contained in one of the search fields.
+
+    The queryset must be ordered. Each page fetches one extra row to find out
+    whether there are more results, instead of counting them.
+    """
+    for word in request.GET.get("term", "").split():
+        queryset = queryset.filter(reduce(operator.or_, (
+            Q(**{"{field}__icontains".format(field=search_field): word})
+            for search_field
+            in search_fields
+        )))
+    offset = (get_page_number(request) - 1) * page_size
+    results = list(queryset[offset:offset + page_size + 1])
+    return JsonResponse({
+        "results": [
+            {"id": force_text(obj.pk), "text": force_text(obj)}
+            for obj
+            in results[:page_size]
+        ],
+        "pagination": {"more": len(results) > page_size},
+    })
+
+
+if AutocompleteSelectMultipleBase is None:  # pragma: no cover
+    AutocompleteSelectMultiple = None
+else:
+    class AutocompleteSelectMultiple(AutocompleteSelectMultipleBase):
+
+        """
+        A select2 widget that searches a usertools autocomplete endpoint.
+
+        Only the selected values are rendered as options.
+        """
+
+        def __init__(self, url_name, rel, admin_site, attrs=None, choices=(), using=None):
+            self.url_name = url_name
+            super(AutocompleteSelectMultiple, self).__init__(rel, admin_site, attrs, choices, using)
+
+        def get_url(self):
+            return reverse("{namespace}:{url_name}".format(
+                namespace=self.admin_site.name,
+                url_name=self.url_name,
+            ))
+
+
+def is_autocomplete_widget(widget):
+    """Returns True if the widget, or the widget it wraps, is a usertools autocomplete widget."""
+    return AutocompleteSelectMultiple is not None and isinstance(
+        getattr(widget, "widget", widget),
+        AutocompleteSelectMultiple,
+    )
+
+
+class AutocompleteAdminMixin(object):
+
+    """
+    Admin mixin providing autocomplete endpoints, and rendering many-to-many
+    fields as paginated autocomplete widgets when autocomplete_widgets is True.
+    """
+
+    # If True, the fields in autocomplete_url_names search an autocomplete endpoint,
+    # instead of rendering every choice in the page.
+    autocomplete_widgets = False
+
+    # A mapping of many-to-many field names to the names of their autocomplete URLs.
+    autocomplete_url_names = {}
+
+    def check_autocomplete_permission(self, request):
+        """Raises PermissionDenied unless the user can view the changelist."""
+        try:
+            has_view_permission = self.has_view_permission(request)
+        except AttributeError:
+            has_view_permission = self.has_change_permission(request)
+        if not has_view_permission:
+            raise PermissionDenied
+
+    def permission_autocomplete(self, request):
+        """Returns a page of the permissions matching a search term, as JSON."""
+        self.check_autocomplete_permission(request)
+        return autocomplete_response(
+            request,
+            Permission.objects.select_related("content_type").order_by(
+                "content_type__app_label", "content_type__model", "codename", "pk",
+            ),
+            ("name", "codename", "content_type__app_label"),
+        )
+
+    def has_autocomplete_widget(self, name):
+        """Returns True if the named field should use an autocomplete widget."""
+        return (
+            self.autocomplete_widgets and
+            AutocompleteSelectMultiple is not None and
+            name in self.autocomplete_url_names
+        )
+
+    def get_autocomplete_widget(self, name, using=None):
+        """Returns an autocomplete widget for the named field."""
+        return AutocompleteSelectMultiple(
+            self.autocomplete_url_names[name],
+            self.model._meta.get_field(name).remote_field,
+            self.admin_site,
+            using=using,
+        )
+
+    def formfield_for_manytomany(self, db_field, request=None, **kwargs):
+        if self.has_autocomplete_widget(db_field.name) and "widget" not in kwargs:
+            kwargs["widget"] = self.get_autocomplete_widget(db_field.name, using=kwargs.get("using"))
+        return super(AutocompleteAdminMixin, self).formfield_for_manytomany(db_field, request, **kwargs)
+
+    def get_form(self, request, obj=None, **kwargs):
+        form = super(AutocompleteAdminMixin, self).get_form(request, obj, **kwargs)
+        # Fields declared on the form class bypass formfield_for_manytomany.
+        for name, field in list(form.base_fields.items()):
+            if self.has_autocomplete_widget(name) and not is_autocomplete_widget(field.widget):
+                field = copy.copy(field)
+                field.widget = self.get_autocomplete_widget(name)
+                field.widget.choices = field.choices
+                field.widget.is_required = field.required
+                form.base_fields[name] = field
+        return form
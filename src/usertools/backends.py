@@ -0,0 +1,31 @@
+"""
+Authentication backends for django-usertools.
+
+To cache group permissions across requests, replace the default model backend
+in your settings:
+
+    AUTHENTICATION_BACKENDS = ("usertools.backends.CachedGroupPermissionsBackend",)
+"""
+
+from __future__ import unicode_literals
+
+from django.contrib.auth.backends import ModelBackend
+
+from usertools.cache import get_cached_group_permissions
+
+
+class CachedGroupPermissionsBackend(ModelBackend):
+
+    """A model backend that reads group permissions from the usertools cache."""
+
+    def get_group_permissions(self, user_obj, obj=None):
+        is_anonymous = user_obj.is_anonymous
+        if callable(is_anonymous):  # Django < 1.10.
+            is_anonymous = is_anonymous()
+        if not user_obj.is_active or is_anonymous or obj is not None:
+            return set()
+        if user_obj.is_superuser:
+            return super(CachedGroupPermissionsBackend, self).get_group_permissions(user_obj, obj)
+        if not hasattr(user_obj, "_group_perm_cache"):
+            user_obj._group_perm_cache = get_cached_group_permissions(user_obj.pk)
+        return user_obj._group_perm_cache
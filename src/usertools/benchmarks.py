@@ -0,0 +1,235 @@
+"""
+Benchmarks for the usertools admin against large synthetic datasets.
+
+Generate a dataset in a development database with the generateusertoolsdata
+command, or run the whole suite against a throwaway test database with the
+benchmarkusertools command.
+"""
+
+from __future__ import unicode_literals
+
+import platform
+import random
+import time
+import uuid
+
+import django
+from django.contrib import admin
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User, Group
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from usertools.bulk import update_users, add_users_to_group, remove_users_from_group
+from usertools.cache import invalidate_groups
+from usertools.importing import iter_batches
+from usertools.pagination import CURSOR_VAR, encode_cursor
+
+
+try:
+    index_range = xrange  # noqa Python 2.
+except NameError:
+    index_range = range
+
+
+def create_users(count, prefix, batch_size=5000, using=DEFAULT_DB_ALIAS):
+    """
+    Bulk creates the given number of synthetic users, with usernames starting
+    with the given prefix, returning their primary keys.
+    """
+    password = make_password(None)
+    username_prefix = "user-{prefix}-".format(prefix=prefix)
+    for offset in range(0, count, batch_size):
+        User.objects.using(using).bulk_create([
+            User(
+                username="{username_prefix}{index:08d}".format(username_prefix=username_prefix, index=index),
+                first_name="First{index}".format(index=index % 1000),
+                last_name="Last{index}".format(index=index % 997),
+                email="{username_prefix}{index:08d}@example.com".format(username_prefix=username_prefix, index=index),
+                password=password,
+            )
+            for index in range(offset, min(offset + batch_size, count))
+        ])
+    # Only some databases return primary keys from a bulk insert.
+    return list(User.objects.using(using).filter(
+        username__startswith=username_prefix,
+    ).order_by("pk").values_list("pk", flat=True))
+
+
+def create_groups(count, prefix, using=DEFAULT_DB_ALIAS):
+    """
+    Bulk creates the given number of synthetic groups, with names starting
+    with the given prefix, returning their primary keys.
+    """
+    name_prefix = "Group {prefix} ".format(prefix=prefix)
+    Group.objects.using(using).bulk_create([
+        Group(name="{name_prefix}{index:06d}".format(name_prefix=name_prefix, index=index))
+        for index in range(count)
+    ])
+    return list(Group.objects.using(using).filter(
+        name__startswith=name_prefix,
+    ).order_by("pk").values_list("pk", flat=True))
+
+
+def create_memberships(user_pks, group_pks, count, batch_size=5000, seed=0, using=DEFAULT_DB_ALIAS):
+    """
+    Bulk creates the given number of distinct memberships between randomly
+    chosen users and groups from the given primary keys.
+    """
+    count = min(count, len(user_pks) * len(group_pks))
+    through = User.groups.through
+    indexes = random.Random(seed).sample(index_range(len(user_pks) * len(group_pks)), count)
+    for batch in iter_batches(indexes, batch_size):
+        through.objects.using(using).bulk_create([
+            through(user_id=user_pks[index // len(group_pks)], group_id=group_pks[index % len(group_pks)])
+            for index in batch
+        ])
+
+
+def create_dataset(users, groups, memberships, batch_size=5000, seed=0, using=DEFAULT_DB_ALIAS):
+    """
+    Bulk creates a synthetic dataset of users, groups and memberships.
+
+    Each dataset gets a unique username and group name prefix, so a dataset
+    can be added to a database that already has one.
+    """
+    prefix = uuid.uuid4().hex[:8]
+    user_pks = create_users(users, prefix, batch_size=batch_size, using=using)
+    group_pks = create_groups(groups, prefix, using=using)
+    create_memberships(user_pks, group_pks, memberships, batch_size=batch_size, seed=seed, using=using)
+    invalidate_groups()
+
+
+def measure(name, func, using=DEFAULT_DB_ALIAS):
+    """Calls func, returning a result dict with the time taken and number of queries run."""
+    with CaptureQueriesContext(connections[using]) as queries:
+        started = time.time()
+        func()
+        seconds = time.time() - started
+    return {
+        "name": name,
+        "seconds": seconds,
+        "queries": len(queries),
+    }
+
+
+def get_request(user, params=None):
+    """Returns a GET request from the given user, that can receive messages."""
+    request = RequestFactory().get("/", params or {})
+    request.user = user
+    request._messages = CookieStorage(request)
+    return request
+
+
+def render_changelist(model_admin, user, params):
+    """Renders the changelist for the given admin, as the given user."""
+    model_admin.changelist_view(get_request(user, params)).render()
+
+
+def benchmark_pagination(user, pages=(1, 100, 1000)):
+    """Compares offset and keyset paging of the user changelist at increasing depths."""
+    model_admin = admin.site._registry[User]
+    per_page = model_admin.list_per_page
+    ordered = User.objects.order_by("username", "-pk")
+    total = ordered.count()
+    results = []
+    scalable_pagination = model_admin.scalable_pagination
+    try:
+        for page in pages:
+            if (page - 1) * per_page >= total:
+                continue
+            model_admin.scalable_pagination = False
+            results.append(measure(
+                "changelist offset page {page}".format(page=page),
+                lambda: render_changelist(model_admin, user, {"p": page - 1}),
+            ))
+            model_admin.scalable_pagination = True
+            params = {}
+            if page > 1:
+                last = ordered.values_list("username", "pk")[(page - 1) * per_page - 1]
+                params[CURSOR_VAR] = encode_cursor("after", list(last))
+            results.append(measure(
+                "changelist keyset page {page}".format(page=page),
+                lambda: render_changelist(model_admin, user, params),
+            ))
+    finally:
+        model_admin.scalable_pagination = scalable_pagination
+    return results
+
+
+def benchmark_actions(user):
+    """Measures building the action list, and running the bulk actions over every user."""
+    model_admin = admin.site._registry[User]
+    request = get_request(user)
+    users = User.objects.all()
+    group = Group.objects.create(name="Benchmark group")
+    invalidate_groups()
+    try:
+        return [
+            measure("get_actions uncached", lambda: model_admin.get_actions(request)),
+            measure("get_actions cached", lambda: model_admin.get_actions(request)),
+            measure("deactivate all users", lambda: update_users(
+                users,
+                batch_size=model_admin.bulk_batch_size,
+                is_active=False,
+            )),
+            measure("activate all users", lambda: update_users(
+                users,
+                batch_size=model_admin.bulk_batch_size,
+                is_active=True,
+            )),
+            measure("add all users to group", lambda: add_users_to_group(
+                users,
+                group,
+                batch_size=model_admin.bulk_batch_size,
+            )),
+            measure("remove all users from group", lambda: remove_users_from_group(users, group)),
+        ]
+    finally:
+        group.delete()
+
+
+def benchmark_groups(user):
+    """Measures the group changelist, and syncing the default groups."""
+    model_admin = admin.site._registry[Group]
+    return [
+        measure("group changelist queryset", lambda: list(model_admin.get_queryset(get_request(user)))),
+        measure("group changelist", lambda: render_changelist(model_admin, user, {})),
+        measure("syncgroups", lambda: call_command("syncgroups", verbosity=0)),
+    ]
+
+
+def run_benchmarks(user):
+    """Runs every benchmark against the current dataset, returning a list of result dicts."""
+    return benchmark_pagination(user) + benchmark_actions(user) + benchmark_groups(user)
+
+
+def get_report(results, using=DEFAULT_DB_ALIAS):
+    """Returns a JSON-serializable report of the given results, and the environment they ran in."""
+    return {
+        "created_at": timezone.now().isoformat(),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "database": connections[using].vendor,
+        "results": results,
+    }
+
+
+def compare_reports(baseline, report):
+    """
+    Yields a (size, name, baseline seconds, seconds) tuple for each result in the
+    report that is also in the baseline.
+    """
+    baseline_seconds = dict(
+        ((result["size"], result["name"]), result["seconds"])
+        for result
+        in baseline["results"]
+    )
+    for result in report["results"]:
+        key = (result["size"], result["name"])
+        if key in baseline_seconds:
+            yield result["size"], result["name"], baseline_seconds[key], result["seconds"]
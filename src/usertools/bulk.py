@@ -0,0 +1,172 @@
+"""Set-based bulk operations on users, used by the django-usertools admin actions."""
+
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+import django
+from django.contrib.auth.models import User, Group
+from django.db import router, transaction
+from django.db.models.signals import m2m_changed
+
+
+# Rows inserted concurrently by another request are skipped, rather than raising an error.
+if django.VERSION >= (2, 2):
+    BULK_CREATE_KWARGS = {"ignore_conflicts": True}
+else:  # pragma: no cover
+    BULK_CREATE_KWARGS = {}
+
+
+def iter_pk_batches(qs, batch_size):
+    """
+    Yields lists of primary keys from the given queryset, in ascending order.
+
+    Each batch is fetched with a keyset query on the primary key, so no batch
+    holds a cursor open while the caller writes to the database.
+    """
+    qs = qs.order_by("pk").values_list("pk", flat=True)
+    last_pk = None
+    while True:
+        batch_qs = qs if last_pk is None else qs.filter(pk__gt=last_pk)
+        pks = list(batch_qs[:batch_size])
+        if not pks:
+            return
+        yield pks
+        if len(pks) < batch_size:
+            return
+        last_pk = pks[-1]
+
+
+def update_users(users, batch_size=1000, skip_unchanged=False, **values):
+    """
+    Updates the users in the given queryset with the given field values.
+
+    Users are updated in primary key ranges of at most batch_size rows, each in
+    its own transaction, so row locks are only held on one batch at a time. If
+    skip_unchanged is True, users that already have the given values are left
+    alone. Returns the number of users updated.
+    """
+    if skip_unchanged:
+        users = users.exclude(**values)
+    db = router.db_for_write(User)
+    count = 0
+    for pks in iter_pk_batches(users, batch_size):
+        with transaction.atomic(using=db):
+            count += users.using(db).filter(pk__gte=pks[0], pk__lte=pks[-1]).update(**values)
+    return count
+
+
+def add_users_to_group(users, group, batch_size=1000):
+    """
+    Adds the users in the given queryset to the group.
+
+    Memberships are inserted in chunks, without loading any user instances.
+    m2m_changed is sent once per chunk from the group side, as if
+    group.user_set.add() had been called. Returns the number of users added.
+    """
+    through = User.groups.through
+    db = router.db_for_write(through)
+    count = 0
+    for pks in iter_pk_batches(users, batch_size):
+        with transaction.atomic(using=db):
+            existing_pks = set(through.objects.using(db).filter(
+                group_id=group.pk,
+                user_id__in=pks,
+            ).values_list("user_id", flat=True))
+            pk_set = set(pks) - existing_pks
+            if not pk_set:
+                continue
+            m2m_changed.send(
+                sender=through, action="pre_add", instance=group, reverse=True, model=User, pk_set=pk_set, using=db,
+            )
+            through.objects.using(db).bulk_create([
+                through(user_id=pk, group_id=group.pk)
+                for pk in sorted(pk_set)
+            ], **BULK_CREATE_KWARGS)
+            m2m_changed.send(
+                sender=through, action="post_add", instance=group, reverse=True, model=User, pk_set=pk_set, using=db,
+            )
+        count += len(pk_set)
+    return count
+
+
+def remove_users_from_group(users, group):
+    """
+    Removes the users in the given queryset from the group.
+
+    Memberships are removed with a single delete query. m2m_changed is sent
+    from the group side, as if group.user_set.remove() had been called, but
+    only if there is a receiver listening. Returns the number of users removed.
+    """
+    through = User.groups.through
+    db = router.db_for_write(through)
+    memberships = through.objects.using(db).filter(
+        group_id=group.pk,
+        user_id__in=users.order_by().values("pk"),
+    )
+    send_signals = m2m_changed.has_listeners(through)
+    with transaction.atomic(using=db):
+        if send_signals:
+            pk_set = set(memberships.values_list("user_id", flat=True))
+            if not pk_set:
+                return 0
+            m2m_changed.send(
+                sender=through, action="pre_remove", instance=group, reverse=True, model=User, pk_set=pk_set, using=db,
+            )
+        count, _ = memberships.delete()
+        if send_signals:
+            m2m_changed.send(
+                sender=through, action="post_remove", instance=group, reverse=True, model=User, pk_set=pk_set, using=db,
+            )
+    return count
+
+
+def create_users(users, group_pks=None):
+    """
+    Inserts the given unsaved users with a single query, returning them with
+    their primary keys set.
+
+    If given, group_pks is a list of the group primary keys for each user. The
+    memberships are inserted with a single query, and m2m_changed is sent once
+    per group from the group side, as if group.user_set.add() had been called.
+    Groups that no longer exist are skipped.
+    """
+    db = router.db_for_write(User)
+    with transaction.atomic(using=db):
+        users = User.objects.using(db).bulk_create(users)
+        # Only some databases return primary keys from a bulk insert.
+        unsaved_users = [user for user in users if user.pk is None]
+        if unsaved_users:
+            pks = dict(User.objects.using(db).filter(
+                username__in=[user.username for user in unsaved_users],
+            ).values_list("username", "pk"))
+            for user in unsaved_users:
+                user.pk = pks[user.username]
+        if not group_pks:
+            return users
+        pk_sets = defaultdict(set)
+        for user, user_group_pks in zip(users, group_pks):
+            for group_pk in user_group_pks:
+                pk_sets[group_pk].add(user.pk)
+        through = User.groups.through
+        groups = Group.objects.using(db).in_bulk(list(pk_sets))
+        # The group pks may come from a stale cache, so skip any group deleted since.
+        pk_sets = dict((group_pk, pk_set) for group_pk, pk_set in pk_sets.items() if group_pk in groups)
+        if not pk_sets:
+            return users
+        for group_pk, pk_set in pk_sets.items():
+            m2m_changed.send(
+                sender=through, action="pre_add", instance=groups[group_pk], reverse=True, model=User, pk_set=pk_set,
+                using=db,
+            )
+        through.objects.using(db).bulk_create([
+            through(user_id=pk, group_id=group_pk)
+            for group_pk, pk_set in pk_sets.items()
+            for pk in sorted(pk_set)
+        ])
+        for group_pk, pk_set in pk_sets.items():
+            m2m_changed.send(
+                sender=through, action="post_add", instance=groups[group_pk], reverse=True, model=User, pk_set=pk_set,
+                using=db,
+            )
+    return users
@@ -0,0 +1,182 @@
+"""Cached lookups used by django-usertools."""
+
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.contrib.auth.models import User, Group
+from django.core.cache import caches
+from django.db import transaction
+
+
+GROUPS_CACHE_KEY = "usertools:groups"
+
+DISPLAY_NAMES_VERSION_CACHE_KEY = "usertools:display_names:version"
+
+GROUP_PERMISSIONS_VERSION_CACHE_KEY = "usertools:group_permissions:version"
+
+
+def get_cache():
+    """Returns the cache used by django-usertools."""
+    return caches[getattr(settings, "USERTOOLS_CACHE", "default")]
+
+
+def get_cache_timeout():
+    """
+    Returns the number of seconds cached lookups are kept for.
+
+    Invalidation only reaches other processes if USERTOOLS_CACHE is shared
+    between them, so this bounds how long a per-process cache can be stale.
+    """
+    return getattr(settings, "USERTOOLS_CACHE_TIMEOUT", 300)
+
+
+def get_groups():
+    """
+    Returns a list of (pk, name) tuples for every group, ordered by name.
+
+    The list is cached until a group is saved or deleted, or the cache timeout
+    expires.
+    """
+    cache = get_cache()
+    groups = cache.get(GROUPS_CACHE_KEY)
+    if groups is None:
+        groups = list(Group.objects.order_by("name").values_list("pk", "name"))
+        cache.set(GROUPS_CACHE_KEY, groups, get_cache_timeout())
+    return groups
+
+
+def invalidate_groups():
+    """Clears the cached list of groups."""
+    get_cache().delete(GROUPS_CACHE_KEY)
+
+
+def get_display_names_version():
+    """Returns the current version of the cached display names."""
+    cache = get_cache()
+    cache.add(DISPLAY_NAMES_VERSION_CACHE_KEY, 1, None)
+    return cache.get(DISPLAY_NAMES_VERSION_CACHE_KEY, 1)
+
+
+def get_display_name_cache_key(user_id, version):
+    return "usertools:display_names:{version}:{user_id}".format(
+        version=version,
+        user_id=user_id,
+    )
+
+
+def get_cached_display_names(user_ids):
+    """
+    Returns a dict of user id to cached display name, for the given user ids.
+
+    Users with no cached display name are missing from the dict. Users with no
+    name are cached as an empty string, so a fallback can be chosen later.
+    """
+    version = get_display_names_version()
+    keys = {get_display_name_cache_key(user_id, version): user_id for user_id in user_ids}
+    return {
+        keys[key]: display_name
+        for key, display_name
+        in get_cache().get_many(keys).items()
+    }
+
+
+def set_cached_display_names(display_names):
+    """Caches the given dict of user id to display name, until the cache timeout expires."""
+    version = get_display_names_version()
+    get_cache().set_many({
+        get_display_name_cache_key(user_id, version): display_name
+        for user_id, display_name
+        in display_names.items()
+    }, get_cache_timeout())
+
+
+def invalidate_display_name(user_id):
+    """Clears the cached display name of the given user."""
+    get_cache().delete(get_display_name_cache_key(user_id, get_display_names_version()))
+
+
+def invalidate_display_names():
+    """Clears every cached display name, for example after a bulk update of users."""
+    cache = get_cache()
+    try:
+        cache.incr(DISPLAY_NAMES_VERSION_CACHE_KEY)
+    except ValueError:
+        cache.set(DISPLAY_NAMES_VERSION_CACHE_KEY, 1, None)
+
+
+def get_group_permissions_version():
+    """Returns the current version of the cached group permissions and memberships."""
+    cache = get_cache()
+    cache.add(GROUP_PERMISSIONS_VERSION_CACHE_KEY, 1, None)
+    return cache.get(GROUP_PERMISSIONS_VERSION_CACHE_KEY, 1)
+
+
+def get_user_groups_cache_key(user_id, version):
+    return "usertools:group_permissions:{version}:user:{user_id}".format(
+        version=version,
+        user_id=user_id,
+    )
+
+
+def get_group_permissions_cache_key(group_id, version):
+    return "usertools:group_permissions:{version}:group:{group_id}".format(
+        version=version,
+        group_id=group_id,
+    )
+
+
+def get_cached_group_permissions(user_id):
+    """
+    Returns the set of "app_label.codename" permission strings the given user
+    has from their groups.
+
+    The user's group ids and the permissions of each group are cached until
+    any group permissions or memberships change, or the cache timeout expires,
+    so a warm cache runs no queries.
+    """
+    cache = get_cache()
+    version = get_group_permissions_version()
+    user_key = get_user_groups_cache_key(user_id, version)
+    group_ids = cache.get(user_key)
+    if group_ids is None:
+        group_ids = list(User.groups.through.objects.filter(user_id=user_id).values_list("group_id", flat=True))
+        cache.set(user_key, group_ids, get_cache_timeout())
+    keys = {get_group_permissions_cache_key(group_id, version): group_id for group_id in group_ids}
+    group_permissions = {
+        keys[key]: permissions
+        for key, permissions
+        in cache.get_many(keys).items()
+    }
+    missing_group_ids = [group_id for group_id in group_ids if group_id not in group_permissions]
+    if missing_group_ids:
+        missing_permissions = {group_id: set() for group_id in missing_group_ids}
+        for group_id, app_label, codename in Group.permissions.through.objects.filter(
+            group_id__in=missing_group_ids,
+        ).values_list("group_id", "permission__content_type__app_label", "permission__codename"):
+            missing_permissions[group_id].add("{app_label}.{codename}".format(app_label=app_label, codename=codename))
+        cache.set_many({
+            get_group_permissions_cache_key(group_id, version): permissions
+            for group_id, permissions
+            in missing_permissions.items()
+        }, get_cache_timeout())
+        group_permissions.update(missing_permissions)
+    return set().union(*group_permissions.values())
+
+
+def incr_group_permissions_version():
+    cache = get_cache()
+    try:
+        cache.incr(GROUP_PERMISSIONS_VERSION_CACHE_KEY)
+    except ValueError:
+        cache.set(GROUP_PERMISSIONS_VERSION_CACHE_KEY, 1, None)
+
+
+def invalidate_group_permissions(using=None):
+    """
+    Clears every cached group permission set and membership list.
+
+    The cache is cleared again when the current transaction commits, since a
+    concurrent request can cache the old permissions before the commit.
+    """
+    incr_group_permissions_version()
+    transaction.on_commit(incr_group_permissions_version, using=using)
@@ -0,0 +1,90 @@
+"""
+Streaming CSV and JSON lines export of users and their groups.
+
+Users are read from the database in chunks, with a single query for the group
+names of each chunk, so memory use doesn't grow with the number of users.
+"""
+
+from __future__ import unicode_literals
+
+import csv
+from collections import defaultdict
+
+import django
+from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+
+from usertools.importing import CSV_BYTES, GROUPS_COLUMN, GROUP_SEPARATOR, iter_batches
+
+
+EXPORT_FIELDS = (
+    "username", "first_name", "last_name", "email", "is_staff", "is_active", "is_superuser",
+    "date_joined", "last_login",
+)
+
+EXPORT_COLUMNS = EXPORT_FIELDS + (GROUPS_COLUMN,)
+
+
+def iter_user_rows(users, chunk_size=2000):
+    """
+    Yields a dict of the export fields and group names for each user in the
+    queryset.
+    """
+    through = User.groups.through
+    rows = users.values_list("pk", *EXPORT_FIELDS)
+    # The chunk_size argument was added in Django 2.0.
+    if django.VERSION >= (2, 0):
+        rows = rows.iterator(chunk_size=chunk_size)
+    else:  # pragma: no cover
+        rows = rows.iterator()
+    for chunk in iter_batches(rows, chunk_size):
+        group_names = defaultdict(list)
+        for user_id, group_name in through.objects.using(users.db).filter(
+            user_id__in=[row[0] for row in chunk],
+        ).order_by("group__name").values_list("user_id", "group__name"):
+            group_names[user_id].append(group_name)
+        for row in chunk:
+            data = dict(zip(EXPORT_FIELDS, row[1:]))
+            data[GROUPS_COLUMN] = group_names[row[0]]
+            yield data
+
+
+class Echo(object):
+
+    """A file-like object that returns what is written to it, for streaming a csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def encode_csv_value(value):
+    """Encodes text for the Python 2 csv module, which only writes byte strings."""
+    if CSV_BYTES and isinstance(value, type("")):  # pragma: no cover
+        return value.encode("utf-8")
+    return value
+
+
+def iter_csv(rows):
+    """Yields the lines of a CSV file of the given user rows, starting with a header."""
+    writer = csv.writer(Echo())
+    yield writer.writerow([encode_csv_value(column) for column in EXPORT_COLUMNS])
+    for row in rows:
+        row = dict(row, **{GROUPS_COLUMN: GROUP_SEPARATOR.join(row[GROUPS_COLUMN])})
+        yield writer.writerow([
+            "" if row[column] is None else encode_csv_value(row[column])
+            for column
+            in EXPORT_COLUMNS
+        ])
+
+
+def iter_jsonl(rows):
+    """Yields a line of JSON for each of the given user rows."""
+    encoder = DjangoJSONEncoder(sort_keys=True)
+    for row in rows:
+        yield encoder.encode(row) + "\n"
+
+
+EXPORT_FORMATS = {
+    "csv": (iter_csv, "text/csv"),
+    "jsonl": (iter_jsonl, "application/x-ndjson"),
+}
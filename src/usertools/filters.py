@@ -0,0 +1,80 @@
+"""List filters used by django-usertools."""
+
+from __future__ import unicode_literals
+
+from django.contrib.admin import FieldListFilter
+from django.contrib.admin.views.main import PAGE_VAR
+from django.contrib.auth.models import Group
+try:
+    from django.urls import reverse
+except ImportError:  # Django < 1.10 pragma: no cover
+    from django.core.urlresolvers import reverse
+
+from usertools.pagination import CURSOR_VAR
+
+
+class GroupAutocompleteFilter(FieldListFilter):
+
+    """
+    Filters by group using a search box, instead of a link for every group.
+
+    Matching groups are loaded page by page from the group autocomplete
+    endpoint, so only the selected group is queried when the changelist loads.
+    """
+
+    template = "admin/usertools/autocomplete_filter.html"
+
+    url_name = "auth_user_group_autocomplete"
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.lookup_kwarg = "{path}__{name}__exact".format(path=field_path, name=field.target_field.name)
+        self.lookup_kwarg_isnull = "{path}__isnull".format(path=field_path)
+        # Clearing the search box submits an empty value.
+        if not params.get(self.lookup_kwarg, True):
+            del params[self.lookup_kwarg]
+        self.lookup_val = params.get(self.lookup_kwarg)
+        self.lookup_val_isnull = params.get(self.lookup_kwarg_isnull)
+        super(GroupAutocompleteFilter, self).__init__(field, request, params, model, model_admin, field_path)
+        self.autocomplete_url = reverse("{namespace}:{url_name}".format(
+            namespace=model_admin.admin_site.name,
+            url_name=self.url_name,
+        ))
+        self.empty_value_display = model_admin.get_empty_value_display()
+
+    def expected_parameters(self):
+        return [self.lookup_kwarg, self.lookup_kwarg_isnull]
+
+    def get_selected_group(self):
+        """Returns the (pk, name) of the selected group, or None."""
+        if not self.lookup_val:
+            return None
+        name = Group.objects.filter(pk=self.lookup_val).values_list("name", flat=True).first()
+        return None if name is None else (self.lookup_val, name)
+
+    def get_hidden_params(self, changelist):
+        """Returns the (name, value) of the other querystring parameters, to submit with the search box."""
+        excluded = set(self.expected_parameters()) | {PAGE_VAR, CURSOR_VAR}
+        return sorted(
+            (name, value)
+            for name, value
+            in changelist.params.items()
+            if name not in excluded
+        )
+
+    def choices(self, changelist):
+        yield {
+            "selected": self.lookup_val is None and not self.lookup_val_isnull,
+            "query_string": changelist.get_query_string({}, [self.lookup_kwarg, self.lookup_kwarg_isnull]),
+            "display": "All",
+        }
+        yield {
+            "selected": bool(self.lookup_val_isnull),
+            "query_string": changelist.get_query_string({self.lookup_kwarg_isnull: "True"}, [self.lookup_kwarg]),
+            "display": self.empty_value_display,
+        }
+        yield {
+            "autocomplete": True,
+            "selected": self.lookup_val is not None,
+            "group": self.get_selected_group(),
+            "params": self.get_hidden_params(changelist),
+        }
@@ -1,15 +1,90 @@
 """Forms used by django-usertools."""
 
 from django import forms
+from django.conf import settings
 from django.contrib.auth.forms import UserCreationForm as UserCreationFormBase, UserChangeForm as UserChangeFormBase
 from django.contrib.auth.models import User, Group
 from django.contrib.admin.widgets import FilteredSelectMultiple, AdminTextInputWidget
+try:
+    from django.contrib.admin.widgets import AutocompleteSelect
+except ImportError:  # Django < 2.0 pragma: no cover
+    AutocompleteSelect = None
+from django.db import router
+from django.forms.models import ModelChoiceIterator
 from django.utils.text import capfirst
 
+from usertools.cache import get_groups
+
 
 def get_default_groups():
-    """Returns the default groups for a user."""
-    return Group.objects.filter(name="Administrators")
+    """Returns the default groups for a user, named by the USERTOOLS_DEFAULT_GROUPS setting."""
+    return Group.objects.filter(name__in=getattr(settings, "USERTOOLS_DEFAULT_GROUPS", ("Administrators",)))
+
+
+def get_default_group_pks():
+    """Returns the primary keys of the default groups for a user, looked up in the cached list of groups."""
+    names = set(getattr(settings, "USERTOOLS_DEFAULT_GROUPS", ("Administrators",)))
+    return [pk for pk, name in get_groups() if name in names]
+
+
+class CachedGroupChoiceIterator(ModelChoiceIterator):
+
+    """
+    Iterates over the cached list of groups, instead of querying the database.
+
+    If the field's queryset has been filtered, ordered by anything but name,
+    or sliced, its choices are loaded from the database as usual.
+    """
+
+    def is_cached(self):
+        query = self.queryset.query
+        return (
+            self.queryset.model is Group and
+            not query.where and
+            tuple(query.order_by) in ((), ("name",)) and
+            not query.extra and
+            not query.annotations and
+            not query.low_mark and
+            query.high_mark is None and
+            self.queryset.db == router.db_for_read(Group)
+        )
+
+    def __iter__(self):
+        if not self.is_cached():
+            for choice in super(CachedGroupChoiceIterator, self).__iter__():
+                yield choice
+            return
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+        for choice in get_groups():
+            yield choice
+
+    def __len__(self):
+        if not self.is_cached():
+            return super(CachedGroupChoiceIterator, self).__len__()
+        return len(get_groups()) + (self.field.empty_label is not None)
+
+    def __bool__(self):
+        if not self.is_cached():
+            return self.field.empty_label is not None or self.queryset.exists()
+        return self.field.empty_label is not None or bool(get_groups())
+
+    __nonzero__ = __bool__
+
+
+class GroupMultipleChoiceField(forms.ModelMultipleChoiceField):
+
+    """
+    A choice of groups, rendered from the cached list of groups.
+
+    Unless the queryset is customised, only validating the chosen groups
+    queries the database.
+    """
+
+    iterator = CachedGroupChoiceIterator
+
+    def __init__(self, queryset=None, **kwargs):
+        super(GroupMultipleChoiceField, self).__init__(Group.objects.all() if queryset is None else queryset, **kwargs)
 
 
 class UserCreationForm(UserCreationFormBase):
@@ -23,11 +98,10 @@ class UserCreationForm(UserCreationFormBase):
         help_text=User._meta.get_field("is_staff").help_text,
     )
 
-    groups = forms.ModelMultipleChoiceField(
+    groups = GroupMultipleChoiceField(
         required=False,
-        queryset=Group.objects.all(),
         widget=FilteredSelectMultiple("groups", False),
-        initial=get_default_groups,
+        initial=get_default_group_pks,
         help_text=User._meta.get_field("groups").help_text,
     )
 
@@ -71,14 +145,61 @@ class UserInviteForm(forms.ModelForm):
 
     # Set the default groups.
 
-    groups = forms.ModelMultipleChoiceField(
+    groups = GroupMultipleChoiceField(
         required=False,
-        queryset=Group.objects.all(),
         widget=FilteredSelectMultiple("groups", False),
-        initial=get_default_groups,
+        initial=get_default_group_pks,
         help_text=User._meta.get_field("groups").help_text,
     )
 
     class Meta:
         fields = ("username", "first_name", "last_name", "email", "groups", "user_permissions", "is_superuser",)
         model = User
+
+
+class UserImportRowForm(UserInviteForm):
+
+    """Validates a single row of a user import, with the same rules as the invite form."""
+
+    # Groups are looked up by name in the cached list of groups.
+    groups = None
+
+    class Meta:
+        fields = ("username", "first_name", "last_name", "email",)
+        model = User
+
+    def validate_unique(self):
+        # Usernames are checked against the database for a whole batch of rows at once.
+        pass
+
+
+class UserImportForm(forms.Form):
+
+    """Form used to upload a CSV file of users to import and invite."""
+
+    csv_file = forms.FileField(
+        label="CSV file",
+        help_text=(
+            "A CSV file with a header row and username, first_name, last_name and email columns. "
+            "An optional groups column holds group names separated by semicolons."
+        ),
+    )
+
+
+class GroupActionForm(forms.Form):
+
+    """Form used to choose the group for a bulk group action."""
+
+    group = forms.ModelChoiceField(
+        queryset=Group.objects.all(),
+    )
+
+    def __init__(self, *args, **kwargs):
+        admin_site = kwargs.pop("admin_site")
+        super(GroupActionForm, self).__init__(*args, **kwargs)
+        # Search for groups on the server, rather than rendering every group in the page.
+        if AutocompleteSelect is not None:
+            field = self.fields["group"]
+            field.widget = AutocompleteSelect(User._meta.get_field("groups").remote_field, admin_site)
+            field.widget.is_required = field.required
+            field.widget.choices = field.choices
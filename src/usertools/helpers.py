@@ -2,8 +2,65 @@
 
 from __future__ import unicode_literals
 
+from django.contrib.auth.models import User
+from django.db.models import Case, CharField, F, Value, When
+from django.db.models.functions import Concat
+
+from usertools.cache import get_cached_display_names, set_cached_display_names
+
 
 def get_display_name(user, fallback=None):
     """Returns a display name for the user."""
     fallback = fallback or "Anonymous"
     return " ".join(p for p in (user.first_name, user.last_name,) if p) or fallback
+
+
+def load_display_names(user_ids):
+    """
+    Returns a dict of user id to display name for the given user ids, without any fallback.
+
+    Display names are cached until the user is saved. Any uncached names are
+    loaded with a single query. Unknown users are missing from the dict, and
+    users with no name have an empty display name.
+    """
+    user_ids = set(user_ids)
+    display_names = get_cached_display_names(user_ids)
+    missing_user_ids = user_ids.difference(display_names)
+    if missing_user_ids:
+        loaded_display_names = {
+            user_id: " ".join(p for p in (user.first_name, user.last_name,) if p)
+            for user_id, user
+            in User.objects.only("first_name", "last_name").in_bulk(missing_user_ids).items()
+        }
+        set_cached_display_names(loaded_display_names)
+        display_names.update(loaded_display_names)
+    return display_names
+
+
+def get_display_names(user_ids, fallback=None):
+    """Returns a dict of user id to display name for the given user ids, using load_display_names()."""
+    fallback = fallback or "Anonymous"
+    display_names = load_display_names(user_ids)
+    return {
+        user_id: display_names.get(user_id) or fallback
+        for user_id
+        in user_ids
+    }
+
+
+def annotate_display_name(qs, fallback=None, name="display_name"):
+    """
+    Annotates the user queryset with a display name, calculated in the database.
+
+    The display name matches get_display_name(), so it can be used with
+    values_list() without loading any user instances. Users with no name are
+    annotated with the fallback if one is given, or an empty string, so the
+    display_name filter can apply its own fallback.
+    """
+    return qs.annotate(**{name: Case(
+        When(first_name="", last_name="", then=Value(fallback or "")),
+        When(first_name="", then=F("last_name")),
+        When(last_name="", then=F("first_name")),
+        default=Concat(F("first_name"), Value(" "), F("last_name")),
+        output_field=CharField(),
+    )})
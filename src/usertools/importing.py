@@ -0,0 +1,105 @@
+"""
+Streaming CSV import of invited users.
+
+The CSV file needs a header row naming its columns. The username, first_name,
+last_name and email columns are required. The optional groups column holds
+group names separated by semicolons.
+"""
+
+from __future__ import unicode_literals
+
+import codecs
+import csv
+from itertools import islice
+
+
+REQUIRED_COLUMNS = ("username", "first_name", "last_name", "email",)
+
+GROUPS_COLUMN = "groups"
+
+GROUP_SEPARATOR = ";"
+
+
+# The Python 2 csv module only reads and writes byte strings.
+CSV_BYTES = str is bytes
+
+
+def decode_csv_value(value):
+    """Decodes a value read by the Python 2 csv module, which may be a list of extra values."""
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    if isinstance(value, list):
+        return [decode_csv_value(item) for item in value]
+    return value
+
+
+def iter_csv_rows(csv_file, encoding="utf-8-sig"):
+    """
+    Yields a (line number, row dict) tuple for each row of the CSV file.
+
+    The file is read a line at a time, so it is never held in memory. Raises
+    ValueError if a required column is missing, or the file cannot be decoded.
+    """
+    lines = codecs.iterdecode(csv_file, encoding)
+    if CSV_BYTES:  # pragma: no cover
+        lines = (line.encode("utf-8") for line in lines)
+    reader = csv.DictReader(lines)
+    try:
+        fieldnames = [decode_csv_value(fieldname) for fieldname in reader.fieldnames or ()]
+    except csv.Error as ex:
+        raise ValueError("The CSV file could not be read: {error}".format(error=ex))
+    missing_columns = [column for column in REQUIRED_COLUMNS if column not in fieldnames]
+    if missing_columns:
+        raise ValueError("The CSV file is missing the {columns} column{plural}.".format(
+            columns=", ".join(missing_columns),
+            plural=len(missing_columns) != 1 and "s" or "",
+        ))
+    try:
+        for row in reader:
+            if CSV_BYTES:  # pragma: no cover
+                row = dict((decode_csv_value(key), decode_csv_value(value)) for key, value in row.items())
+            yield reader.line_num, row
+    except csv.Error as ex:
+        raise ValueError("The CSV file could not be read on line {line}: {error}".format(
+            line=reader.line_num,
+            error=ex,
+        ))
+
+
+def iter_batches(iterable, batch_size):
+    """Yields lists of at most batch_size items from the iterable."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def get_group_names(row):
+    """Returns the list of group names in a CSV row."""
+    return [
+        name.strip()
+        for name
+        in (row.get(GROUPS_COLUMN) or "").split(GROUP_SEPARATOR)
+        if name.strip()
+    ]
+
+
+class ImportReport(object):
+
+    """
+    The outcome of a user import.
+
+    Only the skipped rows are kept, so memory use doesn't grow with the number
+    of users created.
+    """
+
+    def __init__(self):
+        self.created = 0
+        self.invited = 0
+        self.errors = []
+
+    def add_error(self, line_number, username, message):
+        """Records a row that was skipped, or whose user could not be invited."""
+        self.errors.append((line_number, username, message))
@@ -0,0 +1,139 @@
+"""
+Timing and query count instrumentation for the usertools views, actions and commands.
+
+Each instrumented operation sends the operation_finished signal when it ends,
+and is passed to the callable named by the USERTOOLS_METRICS_HOOK setting, if
+any. The operation records its name, wall time, number of queries, number of
+affected users, number of emails sent and time spent talking to the mail server.
+"""
+
+from __future__ import unicode_literals
+
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+from django.dispatch import Signal
+from django.utils.module_loading import import_string
+
+
+# Sent with an operation argument when an instrumented operation ends.
+operation_finished = Signal()
+
+
+_local = threading.local()
+
+
+def get_operations():
+    """Returns the operations being instrumented in the current thread, outermost first."""
+    try:
+        return _local.operations
+    except AttributeError:
+        _local.operations = []
+        return _local.operations
+
+
+def get_metrics_hook():
+    """Returns the callable named by the USERTOOLS_METRICS_HOOK setting, or None."""
+    hook = getattr(settings, "USERTOOLS_METRICS_HOOK", None)
+    if hook is None:
+        return None
+    return import_string(hook)
+
+
+class Operation(object):
+
+    """An instrumented operation, which counts the queries run while it is in progress."""
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0
+        self.queries = 0
+        self.users = 0
+        self.emails_sent = 0
+        self.smtp_seconds = 0
+        self.extra = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def as_dict(self):
+        """Returns the recorded data as a JSON-serializable dict."""
+        return dict(
+            self.extra,
+            name=self.name,
+            seconds=self.seconds,
+            queries=self.queries,
+            users=self.users,
+            emails_sent=self.emails_sent,
+            smtp_seconds=self.smtp_seconds,
+        )
+
+
+@contextmanager
+def instrument(name):
+    """Instruments the code in the block as the named operation, yielding the Operation."""
+    operation = Operation(name)
+    operations = get_operations()
+    operations.append(operation)
+    # Database wrappers are created lazily, so this doesn't open any connections.
+    wrapped_connections = []
+    logged_connections = []
+    for connection in connections.all():
+        if hasattr(connection, "execute_wrappers"):
+            connection.execute_wrappers.append(operation)
+            wrapped_connections.append(connection)
+        else:  # pragma: no cover
+            # Django < 2.0 has no execute wrappers, so the queries are counted from the debug query log instead.
+            # The log keeps the last 9000 queries, so longer operations are undercounted.
+            logged_connections.append((connection, connection.force_debug_cursor, len(connection.queries_log)))
+            connection.force_debug_cursor = True
+    started = time.time()
+    try:
+        yield operation
+    finally:
+        operation.seconds = time.time() - started
+        for connection in wrapped_connections:
+            connection.execute_wrappers.remove(operation)
+        for connection, force_debug_cursor, queries_logged in logged_connections:  # pragma: no cover
+            connection.force_debug_cursor = force_debug_cursor
+            operation.queries += max(len(connection.queries_log) - queries_logged, 0)
+        operations.remove(operation)
+        operation_finished.send(sender=Operation, operation=operation)
+        hook = get_metrics_hook()
+        if hook is not None:
+            hook(operation)
+
+
+def instrumented(name):
+    """Decorator that instruments every call to the function as the named operation."""
+    def decorator(func):
+        @wraps(func)
+        def do_instrumented(*args, **kwargs):
+            with instrument(name):
+                return func(*args, **kwargs)
+        return do_instrumented
+    return decorator
+
+
+def record(users=0, emails_sent=0):
+    """Adds the given counts to every operation in progress in the current thread."""
+    for operation in get_operations():
+        operation.users += users
+        operation.emails_sent += emails_sent
+
+
+@contextmanager
+def record_smtp():
+    """Adds the time spent in the block to the SMTP time of every operation in progress."""
+    started = time.time()
+    try:
+        yield
+    finally:
+        seconds = time.time() - started
+        for operation in get_operations():
+            operation.smtp_seconds += seconds
@@ -0,0 +1,102 @@
+"""Benchmarks the usertools admin against synthetic datasets of increasing size."""
+
+import json
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from usertools.benchmarks import create_dataset, run_benchmarks, get_report, compare_reports
+
+
+class Command(BaseCommand):
+
+    help = "Benchmarks the usertools admin against synthetic datasets of increasing size, in a throwaway test database."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            default="1000,10000,100000",
+            help="A comma-separated list of the numbers of users to benchmark. Defaults to 1000,10000,100000.",
+        )
+        parser.add_argument(
+            "--groups",
+            type=int,
+            default=50,
+            help="The number of groups to create. Defaults to 50.",
+        )
+        parser.add_argument(
+            "--memberships-per-user",
+            type=int,
+            default=2,
+            help="The average number of groups each user belongs to. Defaults to 2.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="The number of rows to create in each query. Defaults to 5000.",
+        )
+        parser.add_argument(
+            "--output",
+            default=None,
+            help="Write a JSON report of the results to the given path.",
+        )
+        parser.add_argument(
+            "--compare",
+            default=None,
+            help="Compare the results with a JSON report written by a previous run.",
+        )
+
+    def handle(self, *args, **kwargs):
+        """Runs the command."""
+        verbosity = int(kwargs.get("verbosity"))
+        try:
+            sizes = [int(size) for size in kwargs["sizes"].split(",")]
+        except ValueError:
+            raise CommandError("--sizes must be a comma-separated list of numbers.")
+        baseline = None
+        if kwargs["compare"]:
+            with open(kwargs["compare"]) as handle:
+                baseline = json.load(handle)
+        connection = connections[DEFAULT_DB_ALIAS]
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=max(verbosity - 1, 0), autoclobber=True)
+        results = []
+        try:
+            for size in sizes:
+                call_command("flush", interactive=False, verbosity=0)
+                if verbosity >= 1:
+                    self.stdout.write("Creating {size} users...\n".format(size=size))
+                create_dataset(
+                    size,
+                    kwargs["groups"],
+                    size * kwargs["memberships_per_user"],
+                    batch_size=kwargs["batch_size"],
+                )
+                user = User.objects.create_superuser("benchmark", "benchmark@example.com", None)
+                for result in run_benchmarks(user):
+                    result["size"] = size
+                    results.append(result)
+                    if verbosity >= 1:
+                        self.stdout.write(
+                            "{size:>8} {name:<40} {seconds:>9.4f}s {queries:>6} queries\n".format(**result),
+                        )
+            report = get_report(results)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=max(verbosity - 1, 0))
+        if kwargs["output"]:
+            with open(kwargs["output"], "w") as handle:
+                json.dump(report, handle, indent=2, sort_keys=True)
+        if baseline is not None:
+            for size, name, baseline_seconds, seconds in compare_reports(baseline, report):
+                self.stdout.write((
+                    "{size:>8} {name:<40} {baseline_seconds:>9.4f}s -> {seconds:>9.4f}s ({ratio:.2f}x)\n"
+                ).format(
+                    size=size,
+                    name=name,
+                    baseline_seconds=baseline_seconds,
+                    seconds=seconds,
+                    ratio=seconds / baseline_seconds if baseline_seconds else 0,
+                ))
@@ -0,0 +1,74 @@
+"""Generates a synthetic dataset of users, groups and memberships."""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from usertools.benchmarks import create_dataset
+
+
+class Command(BaseCommand):
+
+    help = "Generates a synthetic dataset of users, groups and memberships, for benchmarking."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--users",
+            type=int,
+            default=10000,
+            help="The number of users to create. Defaults to 10000.",
+        )
+        parser.add_argument(
+            "--groups",
+            type=int,
+            default=50,
+            help="The number of groups to create. Defaults to 50.",
+        )
+        parser.add_argument(
+            "--memberships",
+            type=int,
+            default=20000,
+            help="The number of memberships to create between the new users and groups. Defaults to 20000.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="The number of rows to create in each query. Defaults to 5000.",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="The random seed used to choose memberships. Defaults to 0.",
+        )
+        parser.add_argument(
+            "--database",
+            default=DEFAULT_DB_ALIAS,
+            help="The database to create the dataset in. Defaults to the \"default\" database.",
+        )
+
+    def handle(self, *args, **kwargs):
+        """Runs the command."""
+        verbosity = int(kwargs.get("verbosity"))
+        using = kwargs["database"]
+        started = time.time()
+        with transaction.atomic(using=using):
+            create_dataset(
+                kwargs["users"],
+                kwargs["groups"],
+                kwargs["memberships"],
+                batch_size=kwargs["batch_size"],
+                seed=kwargs["seed"],
+                using=using,
+            )
+        if verbosity >= 1:
+            self.stdout.write((
+                "Created {users} users, {groups} groups and {memberships} memberships in {seconds:.1f}s.\n"
+            ).format(
+                users=kwargs["users"],
+                groups=kwargs["groups"],
+                memberships=kwargs["memberships"],
+                seconds=time.time() - started,
+            ))
@@ -0,0 +1,71 @@
+"""Sends invitation emails queued in the usertools outbox."""
+
+from django.core.management.base import BaseCommand
+
+from usertools.instrumentation import instrument
+from usertools.outbox import deliver_invitations
+
+
+class Command(BaseCommand):
+
+    help = "Sends invitation emails queued in the usertools outbox."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of invitations to claim from the outbox at a time.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Number of parallel email connections.",
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=None,
+            help="Maximum number of emails to send per second.",
+        )
+        parser.add_argument(
+            "--burst",
+            type=int,
+            default=None,
+            help="Maximum number of emails to send in a burst when rate limited. Defaults to the number of workers.",
+        )
+        parser.add_argument(
+            "--max-attempts",
+            type=int,
+            default=5,
+            help="Number of attempts to make before marking an invitation as failed.",
+        )
+        parser.add_argument(
+            "--backoff",
+            type=float,
+            default=60,
+            help="Seconds to wait before the first retry. Doubles with each subsequent attempt.",
+        )
+
+    def handle(self, *args, **kwargs):
+        """Runs the command."""
+        verbosity = int(kwargs.get("verbosity"))
+        with instrument("usertools.sendinvitations") as operation:
+            sent_count, retry_count, failed_count = deliver_invitations(
+                batch_size=kwargs["batch_size"],
+                workers=kwargs["workers"],
+                rate=kwargs["rate"],
+                burst=kwargs["burst"],
+                max_attempts=kwargs["max_attempts"],
+                backoff=kwargs["backoff"],
+            )
+            # Invitations are delivered from worker threads, so only the totals are recorded.
+            operation.emails_sent = sent_count
+            operation.extra.update(retry=retry_count, failed=failed_count)
+        if verbosity >= 1:
+            self.stdout.write("Sent {sent} invitation(s), {retry} to retry, {failed} failed.\n".format(
+                sent=sent_count,
+                retry=retry_count,
+                failed=failed_count,
+            ))
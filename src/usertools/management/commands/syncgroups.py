@@ -1,34 +1,140 @@
 """Creates or maintains an initial set of authentication groups."""
 
-from django.core.management.base import BaseCommand
-from django.contrib.auth.models import Permission, Group, User
-from django.contrib.contenttypes.models import ContentType
-from django.db.models import Q
-from django.db import transaction
+import time
+from multiprocessing.pool import ThreadPool
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import Permission
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils.encoding import force_text
+
+from usertools.instrumentation import instrument
+from usertools.sync import get_group_definitions, load_group_definitions, get_permission_keys, plan_sync, apply_sync
+
+
+def is_in_memory_database(using):
+    """Returns True if the given database is an in-memory SQLite database."""
+    connection = connections[using]
+    if connection.vendor != "sqlite":
+        return False
+    name = force_text(connection.settings_dict["NAME"])
+    return name == ":memory:" or "mode=memory" in name
 
 
 class Command(BaseCommand):
 
     help = "Creates or maintains an initial set of authentication groups."
 
-    @transaction.atomic()
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--config",
+            default=None,
+            help="Path to a JSON or YAML file of group definitions. Defaults to the USERTOOLS_GROUPS setting.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            default=False,
+            help="Print the changes that would be made, without making them.",
+        )
+        parser.add_argument(
+            "--database",
+            default=DEFAULT_DB_ALIAS,
+            help="The database to sync. Defaults to the \"default\" database.",
+        )
+        parser.add_argument(
+            "--all-databases",
+            action="store_true",
+            default=False,
+            help="Sync every configured database, concurrently where the database backends allow it.",
+        )
+
+    def sync_database(self, definitions, using, dry_run):
+        """Syncs the groups in a single database, returning the plans, permission keys and time taken."""
+        started = time.time()
+        with instrument("usertools.syncgroups") as operation, transaction.atomic(using=using):
+            permission_keys = get_permission_keys(Permission.objects.using(using))
+            plans = plan_sync(definitions, permission_keys, using=using)
+            if not dry_run:
+                apply_sync(plans, using=using)
+            operation.extra.update(database=using, groups=len(plans), dry_run=dry_run)
+        return plans, permission_keys, time.time() - started
+
+    def sync_database_in_turn(self, definitions, using, dry_run):
+        """Syncs the groups in a single database, returning a tuple of (result, error)."""
+        try:
+            return self.sync_database(definitions, using, dry_run), None
+        except Exception as ex:
+            return None, ex
+
+    def sync_database_in_thread(self, args):
+        """Syncs the groups in a single database from a worker thread, closing its connection afterwards."""
+        definitions, using, dry_run = args
+        try:
+            return self.sync_database_in_turn(definitions, using, dry_run)
+        finally:
+            connections[using].close()
+
     def handle(self, *args, **kwargs):
         """Runs the command."""
         verbosity = int(kwargs.get("verbosity"))
-        # Create the administrators group.
-        administrators, _ = Group.objects.get_or_create(name="Administrators")
-        administrator_permissions = Permission.objects.exclude(
-            Q(id__in=administrators.permissions.all()),
-        )
-        administrators.permissions.add(*administrator_permissions)
-        if verbosity >= 2:
-            self.stdout.write("Synced administrators group.\n")
-        # Create the editor group.
-        editors, _ = Group.objects.get_or_create(name="Editors")
-        editor_permissions = Permission.objects.exclude(
-            Q(content_type__in=(ContentType.objects.get_for_model(Group), ContentType.objects.get_for_model(User),)) |
-            Q(id__in=editors.permissions.all()),
-        )
-        editors.permissions.add(*editor_permissions)
-        if verbosity >= 2:
-            self.stdout.write("Synced editors group.\n")
+        dry_run = kwargs["dry_run"]
+        try:
+            definitions = load_group_definitions(kwargs["config"]) if kwargs["config"] else get_group_definitions()
+        except (IOError, ValueError, ImproperlyConfigured) as ex:
+            raise CommandError(str(ex))
+        # Sync the databases, each in its own transaction.
+        if kwargs["all_databases"]:
+            aliases = list(connections)
+        else:
+            aliases = [kwargs["database"]]
+        if len(aliases) == 1:
+            results = [(self.sync_database(definitions, aliases[0], dry_run), None)]
+        elif any(is_in_memory_database(using) for using in aliases):
+            # A connection opened by another thread can't see an in-memory SQLite database, so sync in turn.
+            results = [self.sync_database_in_turn(definitions, using, dry_run) for using in aliases]
+        else:
+            pool = ThreadPool(len(aliases))
+            try:
+                results = pool.map(self.sync_database_in_thread, [(definitions, using, dry_run) for using in aliases])
+            finally:
+                pool.close()
+                pool.join()
+        # Report the changes.
+        errors = []
+        for using, (result, error) in zip(aliases, results):
+            if error is not None:
+                errors.append(using)
+                self.stderr.write("Could not sync groups in {using} database: {error}\n".format(
+                    using=using,
+                    error=error,
+                ))
+                continue
+            plans, permission_keys, duration = result
+            for plan in plans:
+                if dry_run or verbosity >= 2:
+                    self.stdout.write("{verb} {name} group{database}: {create}+{add} -{remove} permissions.\n".format(
+                        verb="Would sync" if dry_run else "Synced",
+                        name=plan.name,
+                        database=" in {using} database".format(using=using) if len(aliases) > 1 else "",
+                        create="create, " if plan.group_id is None else "",
+                        add=len(plan.add),
+                        remove=len(plan.remove),
+                    ))
+                if dry_run and verbosity >= 2:
+                    for prefix, permission_ids in (("+", plan.add), ("-", plan.remove),):
+                        for key in sorted(permission_keys[permission_id] for permission_id in permission_ids):
+                            self.stdout.write("  {prefix} {key}\n".format(
+                                prefix=prefix,
+                                key=key,
+                            ))
+            if verbosity >= 2 or (verbosity >= 1 and kwargs["all_databases"]):
+                self.stdout.write("Synced {using} database in {duration:.2f}s.\n".format(
+                    using=using,
+                    duration=duration,
+                ))
+        if errors:
+            raise CommandError("Could not sync groups in {aliases}.".format(
+                aliases=", ".join(errors),
+            ))
@@ -0,0 +1,19 @@
+"""Rebuilds the stored group member counts."""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from usertools.membercounts import recount
+
+
+class Command(BaseCommand):
+
+    help = "Rebuilds the stored group member counts."
+
+    @transaction.atomic()
+    def handle(self, *args, **kwargs):
+        """Runs the command."""
+        verbosity = int(kwargs.get("verbosity"))
+        recount()
+        if verbosity >= 2:
+            self.stdout.write("Synced group member counts.\n")
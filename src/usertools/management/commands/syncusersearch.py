@@ -0,0 +1,33 @@
+"""Builds the search index used by the configured usertools search backend."""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from usertools.search import clear_installed, get_search_backend
+
+
+class Command(BaseCommand):
+
+    help = "Builds the search index used by the configured usertools search backend."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database",
+            default=DEFAULT_DB_ALIAS,
+            help="The database to index. Defaults to the \"default\" database.",
+        )
+
+    def handle(self, *args, **kwargs):
+        """Runs the command."""
+        verbosity = int(kwargs.get("verbosity"))
+        using = kwargs["database"]
+        search_backend = get_search_backend()
+        if search_backend is None:
+            raise CommandError("No search backend is configured. Set USERTOOLS_SEARCH_BACKEND to enable one.")
+        with transaction.atomic(using=using):
+            search_backend.rebuild(using=using)
+        clear_installed()
+        if verbosity >= 2:
+            self.stdout.write("Synced user search index in {using} database.\n".format(
+                using=using,
+            ))
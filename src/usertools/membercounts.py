@@ -0,0 +1,89 @@
+"""Stored group member counts, used by the group admin instead of counting members on every request."""
+
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.contrib.auth.models import User, Group
+from django.db import router, transaction
+from django.db.models import Count, F
+
+from usertools.models import GroupMemberCount
+
+
+def is_enabled():
+    """Returns True if group member counts should be stored."""
+    return getattr(settings, "USERTOOLS_GROUP_MEMBER_COUNTS", False)
+
+
+def adjust_counts(group_ids, delta, using=None):
+    """Adds delta to the stored member count of each of the given groups."""
+    group_ids = set(group_ids)
+    if not group_ids or not delta:
+        return
+    using = using or router.db_for_write(GroupMemberCount)
+    updated = GroupMemberCount.objects.using(using).filter(group_id__in=group_ids).update(count=F("count") + delta)
+    # Groups created before counts were enabled have no stored count yet.
+    if updated < len(group_ids):
+        recount(group_ids, using=using)
+
+
+def recount(group_ids=None, using=None):
+    """
+    Recalculates the stored member count of the given groups from the membership table.
+
+    If no groups are given, the counts of every group are rebuilt. The counts
+    are replaced in a single transaction, so readers never see them missing.
+    """
+    using = using or router.db_for_write(GroupMemberCount)
+    groups = Group.objects.using(using).all()
+    counts = GroupMemberCount.objects.using(using).all()
+    if group_ids is not None:
+        groups = groups.filter(pk__in=group_ids)
+        counts = counts.filter(group_id__in=group_ids)
+    with transaction.atomic(using=using):
+        counts.delete()
+        GroupMemberCount.objects.using(using).bulk_create([
+            GroupMemberCount(group_id=pk, count=count)
+            for pk, count
+            in groups.order_by().annotate(member_count=Count("user")).values_list("pk", "member_count")
+        ])
+
+
+def recount_missing(using=None):
+    """Stores the member count of every group that has none, such as groups created before counts were enabled."""
+    using = using or router.db_for_write(GroupMemberCount)
+    group_ids = list(Group.objects.using(using).filter(
+        usertools_member_count__isnull=True,
+    ).values_list("pk", flat=True))
+    if group_ids:
+        recount(group_ids, using=using)
+
+
+def memberships_changed(action, instance, reverse, pk_set, using=None, **kwargs):
+    """Updates the stored member counts in response to User.groups m2m_changed signals."""
+    through = User.groups.through
+    using = using or router.db_for_write(through, instance=instance)
+    if reverse:
+        # The instance is a group, and the pk_set contains users.
+        if action == "pre_remove":
+            instance._usertools_removed_count = through.objects.using(using).filter(
+                group_id=instance.pk,
+                user_id__in=pk_set,
+            ).count()
+        elif action == "post_add":
+            adjust_counts((instance.pk,), len(pk_set), using=using)
+        elif action == "post_remove":
+            adjust_counts((instance.pk,), -instance.__dict__.pop("_usertools_removed_count", 0), using=using)
+        elif action == "post_clear":
+            recount((instance.pk,), using=using)
+    else:
+        # The instance is a user, and the pk_set contains groups.
+        if action in ("pre_remove", "pre_clear"):
+            removed = through.objects.using(using).filter(user_id=instance.pk)
+            if action == "pre_remove":
+                removed = removed.filter(group_id__in=pk_set)
+            instance._usertools_removed_group_ids = list(removed.values_list("group_id", flat=True))
+        elif action == "post_add":
+            adjust_counts(pk_set, 1, using=using)
+        elif action in ("post_remove", "post_clear"):
+            adjust_counts(instance.__dict__.pop("_usertools_removed_group_ids", ()), -1, using=using)
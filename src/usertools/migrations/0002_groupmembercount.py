@@ -0,0 +1,22 @@
+# Generated by Django 2.2.28 on 2026-10-18 05:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0001_initial'),
+        ('usertools', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupMemberCount',
+            fields=[
+                ('group', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='usertools_member_count', serialize=False, to='auth.Group')),
+                ('count', models.PositiveIntegerField(db_index=True, default=0)),
+            ],
+        ),
+    ]
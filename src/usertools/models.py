@@ -0,0 +1,122 @@
+"""Models used by django-usertools."""
+
+from __future__ import unicode_literals
+
+from django.contrib.auth.models import User, Group
+from django.core.mail import EmailMessage
+from django.db import models
+from django.utils import timezone
+
+try:
+    from django.utils.encoding import python_2_unicode_compatible
+except ImportError:  # Django 3.0+ only supports Python 3.
+    def python_2_unicode_compatible(cls):
+        return cls
+
+
+@python_2_unicode_compatible
+class InvitationEmail(models.Model):
+
+    """An invitation email waiting in the outbox to be sent by the sendinvitations command."""
+
+    STATUS_PENDING = "pending"
+
+    STATUS_SENT = "sent"
+
+    STATUS_FAILED = "failed"
+
+    STATUS_CHOICES = (
+        (STATUS_PENDING, "pending"),
+        (STATUS_SENT, "sent"),
+        (STATUS_FAILED, "failed"),
+    )
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="+",
+    )
+
+    subject = models.TextField()
+
+    body = models.TextField()
+
+    from_email = models.CharField(
+        max_length=254,
+    )
+
+    recipients = models.TextField(
+        help_text="Newline-separated list of recipients.",
+    )
+
+    digest = models.CharField(
+        max_length=40,
+        db_index=True,
+        help_text="Hash of the email contents, used to skip identical pending invitations.",
+    )
+
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default=STATUS_PENDING,
+    )
+
+    attempts = models.PositiveIntegerField(
+        default=0,
+    )
+
+    last_error = models.TextField(
+        blank=True,
+    )
+
+    created_at = models.DateTimeField(
+        default=timezone.now,
+    )
+
+    next_attempt_at = models.DateTimeField(
+        default=timezone.now,
+    )
+
+    sent_at = models.DateTimeField(
+        blank=True,
+        null=True,
+    )
+
+    def get_email_message(self, connection=None):
+        """Returns the stored invitation as an unsent email message."""
+        return EmailMessage(
+            self.subject,
+            self.body,
+            self.from_email,
+            self.recipients.splitlines(),
+            connection=connection,
+        )
+
+    def __str__(self):
+        return self.subject
+
+    class Meta:
+        index_together = (
+            ("status", "next_attempt_at"),
+        )
+
+
+@python_2_unicode_compatible
+class GroupMemberCount(models.Model):
+
+    """The stored number of members of a group, maintained if USERTOOLS_GROUP_MEMBER_COUNTS is enabled."""
+
+    group = models.OneToOneField(
+        Group,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="usertools_member_count",
+    )
+
+    count = models.PositiveIntegerField(
+        default=0,
+        db_index=True,
+    )
+
+    def __str__(self):
+        return "{count}".format(count=self.count)
@@ -0,0 +1,198 @@
+"""A durable outbox for invitation emails, drained by the sendinvitations command."""
+
+from __future__ import unicode_literals
+
+import hashlib
+import threading
+import time
+from datetime import timedelta
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import connections as db_connections, router, transaction
+from django.utils import timezone
+from django.utils.encoding import force_bytes, force_text
+
+from usertools.models import InvitationEmail
+
+
+monotonic = getattr(time, "monotonic", time.time)
+
+
+def is_enabled():
+    """Returns True if invitation emails should be queued in the outbox rather than sent immediately."""
+    return getattr(settings, "USERTOOLS_INVITATION_OUTBOX", False)
+
+
+def enqueue(message, user):
+    """
+    Queues the given email message for delivery to the given user.
+
+    If an identical invitation is already pending, no new row is created.
+    Returns a tuple of (invitation, created).
+    """
+    recipients = "\n".join(message.to)
+    digest = hashlib.sha1(force_bytes("\0".join((recipients, message.subject, message.body)))).hexdigest()
+    using = router.db_for_write(InvitationEmail)
+    pending = InvitationEmail.objects.using(using).filter(
+        status=InvitationEmail.STATUS_PENDING,
+        digest=digest,
+    ).first()
+    if pending is not None:
+        return pending, False
+    return InvitationEmail.objects.using(using).create(
+        user=user,
+        subject=message.subject,
+        body=message.body,
+        from_email=message.from_email,
+        recipients=recipients,
+        digest=digest,
+    ), True
+
+
+class TokenBucket(object):
+
+    """A thread-safe token bucket, limiting an operation to a sustained rate with bursts up to capacity."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = float(max(capacity, 1))
+        self.tokens = self.capacity
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self):
+        """Takes a token from the bucket, blocking until one is available."""
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def claim_invitations(batch_size, lease, using=None):
+    """
+    Returns a batch of due invitations, leasing them so other workers skip them.
+
+    If the worker dies before recording a result, the lease expires and the
+    invitations become due again.
+    """
+    using = using or router.db_for_write(InvitationEmail)
+    now = timezone.now()
+    leased_until = now + timedelta(seconds=lease)
+    with transaction.atomic(using=using):
+        qs = InvitationEmail.objects.using(using).filter(
+            status=InvitationEmail.STATUS_PENDING,
+            next_attempt_at__lte=now,
+        ).order_by("next_attempt_at", "pk")
+        if getattr(db_connections[using].features, "has_select_for_update_skip_locked", False):
+            invitations = list(qs.select_for_update(skip_locked=True)[:batch_size])
+            InvitationEmail.objects.using(using).filter(
+                pk__in=[invitation.pk for invitation in invitations],
+            ).update(next_attempt_at=leased_until)
+        else:
+            # Without row locks that skip claimed rows, each invitation is claimed with a conditional update,
+            # so an invitation claimed by a concurrent worker in the meantime is skipped.
+            invitations = [
+                invitation
+                for invitation
+                in qs[:batch_size]
+                if lease_invitation(invitation, leased_until, using=using)
+            ]
+    return invitations
+
+
+def lease_invitation(invitation, leased_until, using=None):
+    """
+    Leases the given invitation until the given time, unless it has been
+    leased or sent since it was read.
+
+    Returns True if the invitation was leased.
+    """
+    using = using or router.db_for_write(InvitationEmail)
+    return InvitationEmail.objects.using(using).filter(
+        pk=invitation.pk,
+        status=InvitationEmail.STATUS_PENDING,
+        next_attempt_at=invitation.next_attempt_at,
+    ).update(next_attempt_at=leased_until) == 1
+
+
+def deliver_invitations(
+    batch_size=100, workers=4, rate=None, burst=None, max_attempts=5, backoff=60, lease=300, using=None,
+):
+    """
+    Sends all due invitations in the outbox.
+
+    Emails are sent over one connection per worker thread. If a rate is given,
+    it limits the number of emails sent per second across all workers. Failed
+    emails are retried with exponential backoff, until max_attempts is reached.
+
+    Returns a tuple of (sent count, retry count, failed count).
+    """
+    using = using or router.db_for_write(InvitationEmail)
+    bucket = TokenBucket(rate, burst or workers) if rate else None
+    local = threading.local()
+    connections = []
+    connections_lock = threading.Lock()
+
+    def send(invitation):
+        if bucket is not None:
+            bucket.consume()
+        connection = getattr(local, "connection", None)
+        try:
+            if connection is None:
+                connection = local.connection = get_connection()
+                with connections_lock:
+                    connections.append(connection)
+                # Open the connection now, so it is kept open for every email sent by this worker.
+                connection.open()
+            connection.send_messages([invitation.get_email_message()])
+        except Exception as ex:
+            # Any error is a failed attempt for this invitation only. The connection may be unusable, so a fresh
+            # one is opened for the next email.
+            if connection is not None:
+                connection.close()
+            local.connection = None
+            return force_text(ex) or ex.__class__.__name__
+        return None
+
+    sent_count = retry_count = failed_count = 0
+    pool = ThreadPool(workers)
+    try:
+        while True:
+            invitations = claim_invitations(batch_size, lease, using=using)
+            if not invitations:
+                break
+            errors = pool.map(send, invitations)
+            now = timezone.now()
+            sent_pks = []
+            for invitation, error in zip(invitations, errors):
+                if error is None:
+                    sent_pks.append(invitation.pk)
+                    continue
+                invitation.attempts += 1
+                invitation.last_error = error
+                if invitation.attempts >= max_attempts:
+                    invitation.status = InvitationEmail.STATUS_FAILED
+                    failed_count += 1
+                else:
+                    invitation.next_attempt_at = now + timedelta(seconds=backoff * 2 ** (invitation.attempts - 1))
+                    retry_count += 1
+                invitation.save(using=using, update_fields=("attempts", "last_error", "status", "next_attempt_at",))
+            sent_count += InvitationEmail.objects.using(using).filter(pk__in=sent_pks).update(
+                status=InvitationEmail.STATUS_SENT,
+                sent_at=now,
+                last_error="",
+            )
+    finally:
+        pool.close()
+        pool.join()
+        for connection in connections:
+            connection.close()
+    return sent_count, retry_count, failed_count
@@ -0,0 +1,249 @@
+"""
+Scalable pagination for the user and group changelists.
+
+Set scalable_pagination = True on an admin class to replace the exact COUNT(*)
+with the database planner's row estimate for large result sets, and to page
+with a seek on the ordering columns instead of an OFFSET.
+"""
+
+from __future__ import unicode_literals
+
+import base64
+import json
+import operator
+from functools import reduce
+
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList, PAGE_VAR
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.utils.encoding import force_bytes, force_text
+from django.utils.functional import cached_property
+
+
+try:
+    string_types = (basestring,)  # noqa Python 2.
+except NameError:
+    string_types = (str,)
+
+
+CURSOR_VAR = "cursor"
+
+
+def estimate_count(queryset):
+    """
+    Returns the database planner's estimate of the number of rows in the
+    queryset, or None if the database cannot provide one.
+    """
+    connection = connections[queryset.db]
+    query = queryset.query
+    unfiltered = not query.where and not query.distinct and not getattr(query, "combinator", None)
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            if unfiltered:
+                cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", [
+                    queryset.model._meta.db_table,
+                ])
+                row = cursor.fetchone()
+                # Tables that have never been analyzed report zero or -1 rows.
+                return row[0] if row and row[0] > 0 else None
+            sql, params = query.sql_with_params()
+            cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, string_types):
+                plan = json.loads(plan)
+            return plan[0]["Plan"]["Plan Rows"]
+        if connection.vendor == "mysql" and unfiltered:
+            cursor.execute(
+                "SELECT table_rows FROM information_schema.tables "
+                "WHERE table_schema = DATABASE() AND table_name = %s",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+            return row[0] if row and row[0] else None
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+
+    """
+    A paginator that trusts the planner's row estimate for large querysets.
+
+    Result sets estimated below exact_count_threshold are counted exactly, as
+    are querysets on databases that cannot estimate.
+    """
+
+    exact_count_threshold = 10000
+
+    def __init__(self, *args, **kwargs):
+        self.exact_count_threshold = kwargs.pop("exact_count_threshold", self.exact_count_threshold)
+        super(EstimatedCountPaginator, self).__init__(*args, **kwargs)
+        self.count_is_estimate = False
+
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list)
+        if estimate is None or estimate < self.exact_count_threshold:
+            return self.object_list.count()
+        self.count_is_estimate = True
+        return int(estimate)
+
+
+def encode_cursor(direction, values):
+    """Encodes a position in the changelist as an opaque URL-safe token."""
+    data = json.dumps([direction, values], cls=DjangoJSONEncoder, separators=(",", ":"))
+    return force_text(base64.urlsafe_b64encode(force_bytes(data)))
+
+
+def decode_cursor(token):
+    """Decodes a token created by encode_cursor, raising ValueError if it is invalid."""
+    try:
+        direction, values = json.loads(force_text(base64.urlsafe_b64decode(force_bytes(token))))
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor: {token!r}".format(token=token))
+    if direction not in ("after", "before") or not isinstance(values, list):
+        raise ValueError("Invalid cursor: {token!r}".format(token=token))
+    return direction, values
+
+
+def get_seek_filter(ordering, values, reverse=False):
+    """
+    Returns a filter matching the rows that come after the given values in the
+    ordering, or before them if reverse is True.
+    """
+    clauses = []
+    for index, (field, descending) in enumerate(ordering):
+        lookup = "lt" if descending != reverse else "gt"
+        clause = Q(**{"{name}__{lookup}".format(name=field.name, lookup=lookup): values[index]})
+        for previous_index in range(index):
+            clause &= Q(**{ordering[previous_index][0].name: values[previous_index]})
+        clauses.append(clause)
+    return reduce(operator.or_, clauses)
+
+
+class KeysetChangeList(ChangeList):
+
+    """
+    A changelist that pages by seeking past the last row shown.
+
+    Keyset paging needs an ordering made of non-null columns on the model
+    itself. Other orderings, and the "show all" view, fall back to offsets.
+    """
+
+    def get_filters_params(self, params=None):
+        lookup_params = super(KeysetChangeList, self).get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # Links to a different sort or filter start again from the first page.
+        new_params = new_params or {}
+        remove = list(remove or [])
+        if CURSOR_VAR not in new_params:
+            remove.append(CURSOR_VAR)
+        return super(KeysetChangeList, self).get_query_string(new_params, remove)
+
+    def get_keyset_ordering(self):
+        """Returns a list of (field, descending) pairs, or None if the ordering cannot be seeked."""
+        ordering = []
+        for part in self.queryset.query.order_by:
+            if not isinstance(part, string_types):
+                return None
+            name = part.lstrip("-")
+            try:
+                field = self.opts.pk if name == "pk" else self.opts.get_field(name)
+            except FieldDoesNotExist:
+                return None
+            if not field.concrete or field.is_relation or field.null:
+                return None
+            ordering.append((field, part.startswith("-")))
+        if not any(field.unique for field, _ in ordering):
+            return None
+        return ordering
+
+    def get_results(self, request):
+        self.keyset_ordering = None
+        self.keyset_previous_url = None
+        self.keyset_next_url = None
+        ordering = self.get_keyset_ordering()
+        if ordering is None or self.show_all or self.list_editable:
+            super(KeysetChangeList, self).get_results(request)
+            return
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        queryset = self.queryset
+        direction, values = "after", None
+        if CURSOR_VAR in self.params:
+            try:
+                direction, values = decode_cursor(self.params[CURSOR_VAR])
+                if len(values) != len(ordering):
+                    raise ValueError("Cursor does not match the ordering")
+                values = [field.to_python(value) for (field, _), value in zip(ordering, values)]
+            except (ValueError, ValidationError):
+                raise IncorrectLookupParameters
+            queryset = queryset.filter(get_seek_filter(ordering, values, reverse=direction == "before"))
+        if direction == "before":
+            queryset = queryset.reverse()
+        # Fetch one extra row to find out whether there is another page.
+        result_list = list(queryset[:self.list_per_page + 1])
+        has_more = len(result_list) > self.list_per_page
+        del result_list[self.list_per_page:]
+        if direction == "before":
+            result_list.reverse()
+            has_previous, has_next = has_more, True
+        else:
+            has_previous, has_next = values is not None, has_more
+        if result_list and has_previous:
+            self.keyset_previous_url = self.get_keyset_url("before", ordering, result_list[0])
+        if result_list and has_next:
+            self.keyset_next_url = self.get_keyset_url("after", ordering, result_list[-1])
+        self.keyset_ordering = ordering
+        self.result_count = paginator.count
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.result_list = result_list
+        self.can_show_all = False
+        self.multi_page = has_previous or has_next
+        self.paginator = paginator
+
+    def get_keyset_url(self, direction, ordering, obj):
+        """Returns the query string for the page either side of the given object."""
+        values = [field.value_from_object(obj) for field, _ in ordering]
+        return self.get_query_string({CURSOR_VAR: encode_cursor(direction, values)}, [PAGE_VAR])
+
+
+class ScalablePaginationMixin(object):
+
+    """Admin mixin that enables scalable pagination when scalable_pagination is True."""
+
+    # If True, the changelist uses estimated counts and keyset paging.
+    scalable_pagination = False
+
+    # Result sets estimated to be smaller than this are counted exactly.
+    exact_count_threshold = EstimatedCountPaginator.exact_count_threshold
+
+    @property
+    def show_full_result_count(self):
+        # Counting the unfiltered table is exactly the query scalable pagination avoids.
+        return not self.scalable_pagination
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        if self.scalable_pagination:
+            return EstimatedCountPaginator(
+                queryset,
+                per_page,
+                orphans=orphans,
+                allow_empty_first_page=allow_empty_first_page,
+                exact_count_threshold=self.exact_count_threshold,
+            )
+        return super(ScalablePaginationMixin, self).get_paginator(
+            request, queryset, per_page, orphans, allow_empty_first_page,
+        )
+
+    def get_changelist(self, request, **kwargs):
+        if self.scalable_pagination:
+            return KeysetChangeList
+        return super(ScalablePaginationMixin, self).get_changelist(request, **kwargs)
@@ -0,0 +1,130 @@
+"""
+Rate limiting for the unauthenticated django-usertools views.
+
+Hits are counted in the django-usertools cache, using a sliding window
+counter per client IP address and per target user. Requests over the limit are
+rejected before the view does any database or password hashing work.
+"""
+
+from __future__ import unicode_literals
+
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.encoding import force_bytes
+
+from usertools.cache import get_cache
+
+
+# Maps a scope to the (hits, seconds) allowed per client IP address and per target user.
+DEFAULT_RATE_LIMITS = {
+    "invite_confirm": {
+        "ip": (30, 300),
+        "target": (10, 300),
+    },
+    "password_reset": {
+        "ip": (10, 300),
+        "target": (3, 300),
+    },
+    "password_reset_confirm": {
+        "ip": (30, 300),
+        "target": (10, 300),
+    },
+}
+
+
+def get_rate_limits(scope):
+    """
+    Returns the rate limits for the given scope.
+
+    Limits can be overridden, or disabled by setting them to None, using the
+    USERTOOLS_RATE_LIMITS setting.
+    """
+    rate_limits = dict(DEFAULT_RATE_LIMITS.get(scope, {}))
+    rate_limits.update(getattr(settings, "USERTOOLS_RATE_LIMITS", {}).get(scope, {}))
+    return rate_limits
+
+
+def get_client_ip(request):
+    """
+    Returns the IP address of the client, from the request header named by USERTOOLS_RATE_LIMIT_IP_HEADER.
+
+    Each proxy appends the address it received the request from to
+    X-Forwarded-For, and anything to the left of that is set by the client. The
+    address is taken USERTOOLS_RATE_LIMIT_TRUSTED_PROXIES entries from the
+    right, which is the rightmost entry for a single trusted proxy.
+    """
+    value = request.META.get(getattr(settings, "USERTOOLS_RATE_LIMIT_IP_HEADER", "REMOTE_ADDR"), "")
+    addresses = [address.strip() for address in value.split(",") if address.strip()]
+    if not addresses:
+        return ""
+    trusted_proxies = getattr(settings, "USERTOOLS_RATE_LIMIT_TRUSTED_PROXIES", 1)
+    return addresses[max(len(addresses) - trusted_proxies, 0)]
+
+
+def hit(key, limit, period):
+    """
+    Records a hit against the given key, returning True if the key is over its limit.
+
+    The hit rate is estimated from the counts in the current and previous fixed
+    windows, with the previous window weighted by how much of it still overlaps
+    the sliding window.
+    """
+    cache = get_cache()
+    now = time.time()
+    window = int(now // period)
+    current_key = "{key}:{window}".format(key=key, window=window)
+    previous_key = "{key}:{window}".format(key=key, window=window - 1)
+    cache.add(current_key, 0, period * 2)
+    try:
+        current = cache.incr(current_key)
+    except ValueError:
+        # The counter expired between being added and incremented.
+        cache.set(current_key, 1, period * 2)
+        current = 1
+    previous = cache.get(previous_key, 0)
+    return previous * (1 - (now % period) / period) + current > limit
+
+
+def is_rate_limited(scope, request, target=None):
+    """Records a hit for the request, returning True if the client IP or target user is over its limit."""
+    limited = False
+    for kind, ident in (("ip", get_client_ip(request)), ("target", target),):
+        rate_limit = get_rate_limits(scope).get(kind)
+        if rate_limit is None or not ident:
+            continue
+        limit, period = rate_limit
+        key = "usertools:ratelimit:{scope}:{kind}:{ident}".format(
+            scope=scope,
+            kind=kind,
+            ident=hashlib.md5(force_bytes(ident)).hexdigest(),
+        )
+        limited = hit(key, limit, period) or limited
+    return limited
+
+
+def rate_limit(scope, get_target=None, methods=None):
+    """
+    Decorates a view, rejecting requests over the rate limits for the given scope.
+
+    If given, get_target is called with the view arguments to identify the
+    target user, without touching the database. If methods are given, only
+    requests with those methods are counted.
+    """
+    def decorator(view):
+        @wraps(view)
+        def do_rate_limit(request, *args, **kwargs):
+            if methods is None or request.method in methods:
+                target = get_target(request, *args, **kwargs) if get_target else None
+                if is_rate_limited(scope, request, target):
+                    return HttpResponse(
+                        "Too many requests. Please try again later.",
+                        content_type="text/plain",
+                        status=429,
+                    )
+            return view(request, *args, **kwargs)
+        return do_rate_limit
+    return decorator
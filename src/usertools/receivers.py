@@ -0,0 +1,112 @@
+"""Signal receivers used by django-usertools."""
+
+from __future__ import unicode_literals
+
+from django.contrib.auth.models import User, Group, Permission
+from django.db import connections
+from django.db.models import Max
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed, pre_migrate, post_migrate
+from django.dispatch import receiver
+
+from usertools import membercounts, sync
+from usertools.cache import invalidate_groups, invalidate_display_name, invalidate_group_permissions
+from usertools.models import GroupMemberCount
+from usertools.search import get_search_backend
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, **kwargs):
+    """Clears the cached list of groups when a group changes."""
+    invalidate_groups()
+
+
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Permission)
+@receiver(m2m_changed, sender=Group.permissions.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def group_permissions_changed(sender, using=None, **kwargs):
+    """Clears the cached group permissions when group permissions or memberships change."""
+    invalidate_group_permissions(using=using)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    """Clears the cached display name of a user when it changes."""
+    invalidate_display_name(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, raw=False, using=None, **kwargs):
+    """Reindexes a user in the search backend when it is saved."""
+    search_backend = get_search_backend()
+    if search_backend is not None and not raw:
+        search_backend.update((instance,), using=using)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted_from_search(sender, instance, using=None, **kwargs):
+    """Removes a user from the search backend when it is deleted."""
+    search_backend = get_search_backend()
+    if search_backend is not None:
+        search_backend.remove((instance.pk,), using=using)
+
+
+@receiver(post_save, sender=Group)
+def group_created(sender, instance, created, raw=False, using=None, **kwargs):
+    """Stores an empty member count for new groups."""
+    if created and not raw and membercounts.is_enabled():
+        GroupMemberCount.objects.using(using).create(group=instance)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def group_memberships_changed(sender, **kwargs):
+    """Updates the stored member counts when group memberships change."""
+    if membercounts.is_enabled():
+        membercounts.memberships_changed(**kwargs)
+
+
+@receiver(pre_delete, sender=User)
+def user_deleted(sender, instance, using=None, **kwargs):
+    """Updates the stored member counts when a user is deleted, since no m2m_changed signal is sent."""
+    if membercounts.is_enabled():
+        membercounts.adjust_counts(instance.groups.using(using).values_list("pk", flat=True), -1, using=using)
+
+
+# The highest permission pk seen by migrate, for each database.
+permission_watermarks = {}
+
+# The databases whose current migrate run has reached post_migrate.
+migrated_databases = set()
+
+
+@receiver(pre_migrate)
+def record_permission_watermark(sender, using, **kwargs):
+    """Records the highest existing permission pk, so permissions created by this migrate run can be found."""
+    if not sync.sync_on_migrate():
+        return
+    # pre_migrate is sent for every app at the start of a migrate run, so the watermark is only recorded once per
+    # run. A pre_migrate after a post_migrate starts a new run, whose watermark is recorded afresh.
+    if using in permission_watermarks and using not in migrated_databases:
+        return
+    migrated_databases.discard(using)
+    if Permission._meta.db_table in connections[using].introspection.table_names():
+        watermark = Permission.objects.using(using).aggregate(watermark=Max("pk"))["watermark"]
+    else:
+        watermark = None
+    permission_watermarks[using] = watermark or 0
+
+
+@receiver(post_migrate)
+def grant_new_permissions(sender, using, **kwargs):
+    """Grants permissions created by this migrate run to the synced groups."""
+    if not sync.sync_on_migrate() or using not in permission_watermarks:
+        return
+    migrated_databases.add(using)
+    permission_keys = sync.get_permission_keys(
+        Permission.objects.using(using).filter(pk__gt=permission_watermarks[using]),
+    )
+    if permission_keys:
+        sync.grant_permissions(permission_keys, using=using)
+        permission_watermarks[using] = max(permission_keys)
@@ -0,0 +1,212 @@
+"""
+Indexed search backends for the user changelist.
+
+Set USERTOOLS_SEARCH_BACKEND to the dotted path of a backend class to replace
+the default icontains search, then run the syncusersearch command to build the
+index. Until the index is built, the default search is used. Without a backend,
+django-watson search is used if installed.
+"""
+
+from __future__ import unicode_literals
+
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.module_loading import import_string
+
+from usertools.cache import get_cache_timeout
+
+
+monotonic = getattr(time, "monotonic", time.time)
+
+
+# Whether each backend's index is installed, and when that was checked, for each database alias.
+_installed = {}
+
+
+def clear_installed():
+    """Forgets whether the search indexes are installed, so the next use checks the database again."""
+    _installed.clear()
+
+
+class SearchBackend(object):
+
+    """Base class for user search backends."""
+
+    def install(self, using=DEFAULT_DB_ALIAS):
+        """Creates the search index in the given database."""
+        raise NotImplementedError
+
+    def is_installed(self, using=DEFAULT_DB_ALIAS):
+        """
+        Returns True if the search index has been created in the given database.
+
+        The result is kept for each database alias, so saving a user or
+        searching doesn't check the database every time. Until the index is
+        installed, the database is checked again once the cache timeout expires.
+        """
+        key = (self.__class__, using)
+        installed, checked = _installed.get(key, (False, None))
+        if not installed and (checked is None or monotonic() - checked >= get_cache_timeout()):
+            installed = self.check_installed(using)
+            _installed[key] = (installed, monotonic())
+        return installed
+
+    def check_installed(self, using=DEFAULT_DB_ALIAS):
+        """Checks the given database for the search index."""
+        raise NotImplementedError
+
+    def rebuild(self, using=DEFAULT_DB_ALIAS):
+        """Reindexes every user in the given database."""
+        raise NotImplementedError
+
+    def update(self, users, using=DEFAULT_DB_ALIAS):
+        """Reindexes the given users. Backends whose index is maintained by the database do nothing."""
+
+    def remove(self, user_ids, using=DEFAULT_DB_ALIAS):
+        """Removes the given users from the index. Backends whose index is maintained by the database do nothing."""
+
+    def search(self, queryset, search_term):
+        """Returns the queryset filtered to users matching every word in the search term."""
+        raise NotImplementedError
+
+
+class SQLiteFTS5Backend(SearchBackend):
+
+    """
+    Searches an SQLite FTS5 table, updated whenever a user is saved or deleted.
+
+    Each word of the search term matches the start of any word in the username,
+    name or email address.
+    """
+
+    table_name = "usertools_user_search"
+
+    def install(self, using=DEFAULT_DB_ALIAS):
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS {table} "
+                "USING fts5(username, first_name, last_name, email)".format(
+                    table=self.table_name,
+                )
+            )
+
+    def check_installed(self, using=DEFAULT_DB_ALIAS):
+        connection = connections[using]
+        with connection.cursor() as cursor:
+            return self.table_name in connection.introspection.table_names(cursor)
+
+    def rebuild(self, using=DEFAULT_DB_ALIAS):
+        self.install(using)
+        with connections[using].cursor() as cursor:
+            cursor.execute("DELETE FROM {table}".format(table=self.table_name))
+            cursor.execute(
+                "INSERT INTO {table} (rowid, username, first_name, last_name, email) "
+                "SELECT id, username, first_name, last_name, email FROM {user_table}".format(
+                    table=self.table_name,
+                    user_table=User._meta.db_table,
+                )
+            )
+
+    def update(self, users, using=DEFAULT_DB_ALIAS):
+        # Until syncusersearch creates the table, there is no index to maintain.
+        if not self.is_installed(using):
+            return
+        self.remove([user.pk for user in users], using)
+        with connections[using].cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO {table} (rowid, username, first_name, last_name, email) "
+                "VALUES (%s, %s, %s, %s, %s)".format(
+                    table=self.table_name,
+                ),
+                [(user.pk, user.username, user.first_name, user.last_name, user.email) for user in users],
+            )
+
+    def remove(self, user_ids, using=DEFAULT_DB_ALIAS):
+        if not self.is_installed(using):
+            return
+        with connections[using].cursor() as cursor:
+            cursor.executemany(
+                "DELETE FROM {table} WHERE rowid = %s".format(
+                    table=self.table_name,
+                ),
+                [(user_id,) for user_id in user_ids],
+            )
+
+    def search(self, queryset, search_term):
+        query = " ".join(
+            "\"{word}\"*".format(word=word.replace("\"", "\"\""))
+            for word
+            in search_term.split()
+        )
+        return queryset.extra(
+            where=("{user_table}.{pk} IN (SELECT rowid FROM {table} WHERE {table} MATCH %s)".format(
+                user_table=connections[queryset.db].ops.quote_name(User._meta.db_table),
+                pk=connections[queryset.db].ops.quote_name(User._meta.pk.column),
+                table=self.table_name,
+            ),),
+            params=(query,),
+        )
+
+
+class PostgresTrigramBackend(SearchBackend):
+
+    """
+    Searches a pg_trgm expression index on the user table, maintained by PostgreSQL itself.
+
+    Each word of the search term matches anywhere in the username, name or
+    email address, like the default icontains search.
+    """
+
+    index_name = "usertools_user_search_trgm"
+
+    expression = "LOWER({fields})".format(fields=" || ' ' || ".join(
+        "\"{table}\".\"{column}\"".format(
+            table=User._meta.db_table,
+            column=column,
+        )
+        for column
+        in ("username", "first_name", "last_name", "email",)
+    ))
+
+    def install(self, using=DEFAULT_DB_ALIAS):
+        with connections[using].cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS {index} ON {user_table} USING gin (({expression}) gin_trgm_ops)".format(
+                    index=self.index_name,
+                    user_table=User._meta.db_table,
+                    expression=self.expression,
+                )
+            )
+
+    def check_installed(self, using=DEFAULT_DB_ALIAS):
+        with connections[using].cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_indexes WHERE indexname = %s", (self.index_name,))
+            return cursor.fetchone() is not None
+
+    def rebuild(self, using=DEFAULT_DB_ALIAS):
+        self.install(using)
+        with connections[using].cursor() as cursor:
+            cursor.execute("REINDEX INDEX {index}".format(index=self.index_name))
+
+    def search(self, queryset, search_term):
+        for word in search_term.split():
+            pattern = "%{word}%".format(
+                word=word.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_"),
+            )
+            queryset = queryset.extra(
+                where=("{expression} LIKE %s".format(expression=self.expression),),
+                params=(pattern,),
+            )
+        return queryset
+
+
+def get_search_backend():
+    """Returns the search backend configured by USERTOOLS_SEARCH_BACKEND, or None."""
+    backend_path = getattr(settings, "USERTOOLS_SEARCH_BACKEND", None)
+    if backend_path is None:
+        return None
+    return import_string(backend_path)()
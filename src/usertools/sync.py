@@ -0,0 +1,153 @@
+"""
+Declarative group definitions, as synced by the syncgroups command.
+
+Each group definition is a dict with optional "include" and "exclude" lists of
+permission patterns. A pattern is matched against "app_label.model.codename"
+using shell-style wildcards, so "*" matches every permission and "auth.user.*"
+matches every permission on the user model.
+"""
+
+from __future__ import unicode_literals
+
+import json
+from collections import namedtuple
+from fnmatch import fnmatchcase
+
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS
+
+from usertools.cache import invalidate_group_permissions
+
+
+DEFAULT_GROUPS = {
+    "Administrators": {
+        "include": ["*"],
+    },
+    "Editors": {
+        "include": ["*"],
+        "exclude": ["auth.group.*", "auth.user.*"],
+    },
+}
+
+
+GroupPlan = namedtuple("GroupPlan", ("name", "group_id", "add", "remove",))
+
+
+def get_group_definitions():
+    """Returns the group definitions from the USERTOOLS_GROUPS setting."""
+    return getattr(settings, "USERTOOLS_GROUPS", DEFAULT_GROUPS)
+
+
+def sync_on_migrate():
+    """Returns True if permissions created by migrate should be granted to the synced groups."""
+    return getattr(settings, "USERTOOLS_SYNC_GROUPS_ON_MIGRATE", False)
+
+
+def load_group_definitions(path):
+    """Loads group definitions from a JSON or YAML file."""
+    with open(path) as handle:
+        if path.endswith((".yaml", ".yml",)):
+            try:
+                import yaml
+            except ImportError:
+                raise ImproperlyConfigured("PyYAML is required to load group definitions from {path}.".format(
+                    path=path,
+                ))
+            definitions = yaml.safe_load(handle)
+        else:
+            definitions = json.load(handle)
+    if not isinstance(definitions, dict):
+        raise ImproperlyConfigured("Group definitions in {path} must be a mapping of group names.".format(
+            path=path,
+        ))
+    return definitions
+
+
+def permission_matches(definition, key):
+    """Returns True if the group definition includes the permission with the given key."""
+    return (
+        any(fnmatchcase(key, pattern) for pattern in definition.get("include", ())) and
+        not any(fnmatchcase(key, pattern) for pattern in definition.get("exclude", ()))
+    )
+
+
+def get_permission_keys(permissions):
+    """Returns a dict of permission pk to "app_label.model.codename" key, for the given permission queryset."""
+    return {
+        pk: "{app_label}.{model}.{codename}".format(
+            app_label=app_label,
+            model=model,
+            codename=codename,
+        )
+        for pk, app_label, model, codename
+        in permissions.values_list("pk", "content_type__app_label", "content_type__model", "codename").iterator()
+    }
+
+
+def plan_sync(definitions, permission_keys, using=DEFAULT_DB_ALIAS):
+    """
+    Returns a list of GroupPlan, describing the changes needed to make the groups match their definitions.
+
+    Groups that do not exist yet have a group_id of None.
+    """
+    group_ids = dict(Group.objects.using(using).filter(name__in=definitions).values_list("name", "pk"))
+    existing = {}
+    for group_id, permission_id in Group.permissions.through.objects.using(using).filter(
+        group_id__in=group_ids.values(),
+    ).values_list("group_id", "permission_id").iterator():
+        existing.setdefault(group_id, set()).add(permission_id)
+    plans = []
+    for name, definition in sorted(definitions.items()):
+        group_id = group_ids.get(name)
+        wanted = set(pk for pk, key in permission_keys.items() if permission_matches(definition, key))
+        current = existing.get(group_id, set())
+        plans.append(GroupPlan(name, group_id, wanted - current, current - wanted))
+    return plans
+
+
+def apply_sync(plans, using=DEFAULT_DB_ALIAS):
+    """Applies the given group plans, creating groups and adding or removing permissions in bulk."""
+    through = Group.permissions.through
+    rows = []
+    for plan in plans:
+        group_id = plan.group_id
+        if group_id is None:
+            group_id = Group.objects.using(using).create(name=plan.name).pk
+        elif plan.remove:
+            through.objects.using(using).filter(group_id=group_id, permission_id__in=plan.remove).delete()
+        rows.extend(
+            through(group_id=group_id, permission_id=permission_id)
+            for permission_id
+            in sorted(plan.add)
+        )
+    through.objects.using(using).bulk_create(rows)
+    invalidate_group_permissions(using=using)
+
+
+def grant_permissions(permission_keys, definitions=None, using=DEFAULT_DB_ALIAS):
+    """
+    Grants the given permissions to every existing group whose definition includes them.
+
+    Unlike a full sync, no permissions are removed and no groups are created.
+    Returns the number of permissions granted.
+    """
+    if definitions is None:
+        definitions = get_group_definitions()
+    through = Group.permissions.through
+    existing = set(through.objects.using(using).filter(
+        permission_id__in=permission_keys,
+    ).values_list("group_id", "permission_id"))
+    rows = [
+        through(group_id=group_id, permission_id=permission_id)
+        for name, group_id
+        in Group.objects.using(using).filter(name__in=definitions).values_list("name", "pk")
+        for permission_id, key
+        in sorted(permission_keys.items())
+        if permission_matches(definitions[name], key) and (group_id, permission_id) not in existing
+    ]
+    through.objects.using(using).bulk_create(rows)
+    if rows:
+        invalidate_group_permissions(using=using)
+    return len(rows)
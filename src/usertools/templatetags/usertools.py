@@ -2,15 +2,100 @@
 
 from __future__ import absolute_import
 
+import re
+import uuid
+
 from django import template
+from django.contrib.auth.models import User
+from django.utils.html import conditional_escape
+from django.utils.safestring import mark_safe
 
-from usertools.helpers import get_display_name
+from usertools.helpers import get_display_name, get_display_names, load_display_names
 
 
 register = template.Library()
 
 
+COLLECTOR_CONTEXT_NAME = "usertools_display_names"
+
+
 @register.filter
 def display_name(user, fallback=None):
-    """Returns a display name for the user."""
+    """
+    Returns a display name for the user.
+
+    If the user was loaded with annotate_display_name(), the annotated value is used.
+    """
+    annotated_display_name = getattr(user, "display_name", None)
+    if annotated_display_name is not None:
+        return annotated_display_name or fallback or "Anonymous"
     return get_display_name(user, fallback=fallback)
+
+
+class DisplayNameCollector(object):
+
+    """Collects the user ids rendered in a display_names block, so they can be resolved together."""
+
+    def __init__(self):
+        self.token = uuid.uuid4().hex
+        self.lookups = []
+
+    def add(self, user_id, fallback):
+        """Records a lookup, returning a placeholder to be replaced with the display name."""
+        self.lookups.append((user_id, fallback,))
+        return mark_safe("\x1e{token}:{index}\x1e".format(
+            token=self.token,
+            index=len(self.lookups) - 1,
+        ))
+
+    def resolve(self, output, autoescape):
+        """Replaces the placeholders in the output with display names."""
+        display_names = load_display_names(user_id for user_id, _ in self.lookups)
+
+        def replace(match):
+            user_id, fallback = self.lookups[int(match.group(1))]
+            value = display_names.get(user_id) or fallback or "Anonymous"
+            return conditional_escape(value) if autoescape else value
+
+        return re.sub("\x1e{token}:(\\d+)\x1e".format(token=self.token), replace, output)
+
+
+class DisplayNamesNode(template.Node):
+
+    def __init__(self, nodelist):
+        self.nodelist = nodelist
+
+    def render(self, context):
+        collector = DisplayNameCollector()
+        with context.push(**{COLLECTOR_CONTEXT_NAME: collector}):
+            output = self.nodelist.render(context)
+        return mark_safe(collector.resolve(output, context.autoescape))
+
+
+@register.tag
+def display_names(parser, token):
+    """
+    Resolves the display names of every user_display_name tag in the block with a single query.
+
+    {% display_names %}
+        {% for entry in entries %}{% user_display_name entry.user_id %}{% endfor %}
+    {% enddisplay_names %}
+    """
+    nodelist = parser.parse(("enddisplay_names",))
+    parser.delete_first_token()
+    return DisplayNamesNode(nodelist)
+
+
+@register.simple_tag(takes_context=True)
+def user_display_name(context, user_id, fallback=None):
+    """
+    Returns a display name for the user with the given id.
+
+    Inside a display_names block, the lookup is batched with the rest of the block.
+    """
+    if isinstance(user_id, User):
+        return display_name(user_id, fallback=fallback)
+    collector = context.get(COLLECTOR_CONTEXT_NAME)
+    if collector is None:
+        return get_display_names((user_id,), fallback=fallback)[user_id]
+    return collector.add(user_id, fallback)
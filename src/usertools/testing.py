@@ -0,0 +1,56 @@
+"""
+Test helpers for django-usertools, and projects that use it.
+
+Use assert_max_queries to give an admin operation a query budget, so that N+1
+regressions fail the test suite, and capture_operations to inspect the
+instrumentation recorded by usertools.
+"""
+
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+
+from usertools.instrumentation import operation_finished
+
+
+@contextmanager
+def assert_max_queries(budget, using=DEFAULT_DB_ALIAS):
+    """Fails if the code in the block runs more than budget queries, listing the queries that ran."""
+    with CaptureQueriesContext(connections[using]) as queries:
+        yield queries
+    if len(queries) > budget:
+        raise AssertionError("{count} queries executed, at most {budget} expected:\n{queries}".format(
+            count=len(queries),
+            budget=budget,
+            queries="\n".join(
+                "{index}. {sql}".format(index=index, sql=query["sql"])
+                for index, query
+                in enumerate(queries.captured_queries, start=1)
+            ),
+        ))
+
+
+@contextmanager
+def capture_operations():
+    """Yields a list of the instrumented operations that finish in the block."""
+    operations = []
+
+    def receiver(sender, operation, **kwargs):
+        operations.append(operation)
+
+    operation_finished.connect(receiver, weak=False)
+    try:
+        yield operations
+    finally:
+        operation_finished.disconnect(receiver)
+
+
+class QueryBudgetMixin(object):
+
+    """TestCase mixin providing assertMaxQueries."""
+
+    def assertMaxQueries(self, budget, using=DEFAULT_DB_ALIAS):
+        return assert_max_queries(budget, using=using)
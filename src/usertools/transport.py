@@ -0,0 +1,102 @@
+"""
+Transports that deliver invitation emails for newly invited users.
+
+By default, the invitation email is sent in the request that invites the user.
+Set USERTOOLS_INVITATION_TRANSPORT to "usertools.transport.BackgroundTransport"
+to hand it to a small pool of background threads instead, so a slow mail server
+doesn't hold a request worker for the whole SMTP round trip.
+"""
+
+from __future__ import unicode_literals
+
+import atexit
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from usertools.instrumentation import instrument, record, record_smtp
+
+
+logger = logging.getLogger("usertools")
+
+
+class InlineTransport(object):
+
+    """Sends each email in the calling thread."""
+
+    background = False
+
+    def send(self, message):
+        """Sends the given email message, raising any delivery error."""
+        message.send()
+
+    def wait(self):
+        """Waits for every email handed to the transport to be delivered."""
+
+
+class BackgroundTransport(InlineTransport):
+
+    """
+    Sends each email from a pool of background threads.
+
+    Each delivery is instrumented as the usertools.deliver_invitation
+    operation. Delivery errors are logged, since the request that sent the
+    email has already returned.
+    """
+
+    background = True
+
+    def __init__(self, workers=None):
+        self.workers = workers or getattr(settings, "USERTOOLS_INVITATION_WORKERS", 4)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pending = []
+
+    def deliver(self, message):
+        with instrument("usertools.deliver_invitation"):
+            try:
+                with record_smtp():
+                    message.send()
+            except Exception:
+                # Nothing reads the result of a background delivery, so every error is logged.
+                logger.exception("Could not send an invitation email to %s", ", ".join(message.to))
+            else:
+                record(emails_sent=1)
+
+    def send(self, message):
+        """Queues the given email message for delivery, returning immediately."""
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.workers)
+                atexit.register(self.close)
+            self._pending = [result for result in self._pending if not result.ready()]
+            self._pending.append(self._pool.apply_async(self.deliver, (message,)))
+
+    def wait(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for result in pending:
+            result.wait()
+
+    def close(self):
+        """Waits for every pending email to be delivered, then stops the background threads."""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+_transports = {}
+
+
+def get_transport():
+    """Returns the transport named by the USERTOOLS_INVITATION_TRANSPORT setting, shared by every request."""
+    path = getattr(settings, "USERTOOLS_INVITATION_TRANSPORT", "usertools.transport.InlineTransport")
+    try:
+        return _transports[path]
+    except KeyError:
+        return _transports.setdefault(path, import_string(path)())
@@ -6,12 +6,18 @@ except ImportError:  # Django < 1.10 pragma: no cover
     from django.core.urlresolvers import reverse_lazy
 from django.contrib.auth import views as auth_views
 
+from usertools.ratelimit import rate_limit
+
 
 urlpatterns = [
     # Password reset workflow.
     url(
         "^password-reset/$",
-        auth_views.PasswordResetView.as_view(),
+        rate_limit(
+            "password_reset",
+            get_target=lambda request, **kwargs: request.POST.get("email", "").strip().lower(),
+            methods=("POST",),
+        )(auth_views.PasswordResetView.as_view()),
         name="admin_password_reset",
         kwargs={
             "email_template_name": "admin/auth/user/password_reset_email.txt",
@@ -24,7 +30,10 @@ urlpatterns = [
     ),
     url(
         "^password-reset/token/(?P<uidb64>[0-9A-Za-z]+)-(?P<token>.+)/$",
-        auth_views.PasswordResetConfirmView.as_view(),
+        rate_limit(
+            "password_reset_confirm",
+            get_target=lambda request, uidb64, token: uidb64,
+        )(auth_views.PasswordResetConfirmView.as_view()),
         name="password_reset_confirm",
     ),
     url(